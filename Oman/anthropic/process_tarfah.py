@@ -1,17 +1,22 @@
 import os
 import json
-import time
 import base64
+import asyncio
 import concurrent.futures
 from typing import Dict, List, Any
 import logging
-from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
-from pdf2image import convert_from_path
-from PIL import Image
-import io
-import random
 import dotenv
 
+# Shared pipeline modules from the parent Oman/ directory (on PYTHONPATH, see run_process.sh)
+from vision_pipeline import RateLimiter, run_pipeline
+from page_renderer import PageRenderer, render_page, DEFAULT_DPI
+from image_optimizer import optimize_page, describe
+from page_tiles import split_page, merge_tile_entries, entry_key
+from response_cache import ResponseCache
+from extraction_backend import AnthropicBackend
+from json_rows import RowStream
+from extraction_schema import ROWS_PROMPT
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -23,115 +28,150 @@ dotenv.load_dotenv('/home/computeruse/test_data/Oman/anthropic/.env')
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
 PDF_PATH = '/home/computeruse/test_data/Oman/tarfah.pdf'
 OUTPUT_DIR = '/home/computeruse/test_data/Oman/anthropic'
-MAX_WORKERS = 5  # Limit concurrency to prevent rate limiting
+MAX_WORKERS = 5  # Pages in flight at once
 MODEL = 'claude-3-7-sonnet-20250219'
+MAX_TOKENS = 4000
+# Account quota; requests are paced by these instead of fixed sleeps
+REQUESTS_PER_MINUTE = 50
+TOKENS_PER_MINUTE = 40000
+# Split dense pages into overlapping row tiles so each response fits in MAX_TOKENS
+TILE_PAGES = False
+# Stream responses and write each page's rows to page_N_rows.jsonl as they arrive
+STREAM_RESPONSES = False
+# Return rows through a forced tool call with extraction_schema.ROWS_TOOL as its input schema
+STRUCTURED_OUTPUT = False
+
+PROMPT = ROWS_PROMPT
+
+RESPONSE_CACHE = ResponseCache()
+# Requests, retries, the response cache and continuation of truncated responses
+BACKEND = AnthropicBackend(model=MODEL, max_tokens=MAX_TOKENS, api_key=ANTHROPIC_API_KEY, prompt=PROMPT,
+                           structured=STRUCTURED_OUTPUT, cache=RESPONSE_CACHE, log=logger.info)
+
+def encode_image_to_base64(image: bytes):
+    """Convert page image bytes to a base64 encoded string"""
+    return base64.b64encode(image).decode('utf-8')
+
+def page_result(page_num: int, page: Dict[str, Any]) -> Dict[str, Any]:
+    """A backend page in this script's result format: rows under "data", failures under "error"."""
+    if isinstance(page.get("entries"), list):
+        result = {"page": page_num, "data": page["entries"]}
+        for key in ("continuations", "truncated"):
+            if key in page:
+                result[key] = page[key]
+        if "malformed_entries" in page:
+            result["malformed_rows"] = page["malformed_entries"]
+        logger.info(f"Successfully processed page {page_num}")
+        return result
+    error = page.get("error") or page.get("parsing_error") or "No rows in the response"
+    logger.warning(f"Page {page_num} failed: {error}")
+    result = {"page": page_num, "error": error}
+    if "raw_content" in page:
+        result["raw_response"] = page["raw_content"]
+    return result
 
-def encode_image_to_base64(img):
-    """Convert PIL Image to base64 encoded string"""
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+async def process_page_async(page_num: int, image: bytes, media_type: str = "image/png",
+                             limiter: RateLimiter = None, stream: RowStream = None) -> Dict[str, Any]:
+    """Process a single page with the Claude API, each request (retries and continuations too) paced by limiter"""
+    page = await BACKEND.extract_page(encode_image_to_base64(image), media_type, page_num, limiter, stream)
+    return page_result(page_num, page)
 
-def process_page(page_num: int, image) -> Dict[str, Any]:
+def process_page(page_num: int, image: bytes, media_type: str = "image/png",
+                 stream: RowStream = None) -> Dict[str, Any]:
     """Process a single page with the Claude API"""
+    return asyncio.run(process_page_async(page_num, image, media_type, stream=stream))
+
+def save_page_result(output_dir: str, page_num: int, result: Dict[str, Any]):
+    """Save an individual page result"""
+    output_file = os.path.join(output_dir, f"page_{page_num}_result.json")
+    with open(output_file, "w") as f:
+        json.dump(result, f, indent=4)
+    logger.info(f"Saved result for page {page_num} to {output_file}")
+
+def row_stream(output_dir: str, page_num: int, index: int, tile_count: int):
+    """RowStream writing a page's (or tile's) rows to output_dir as they arrive, when STREAM_RESPONSES is set"""
+    if not STREAM_RESPONSES:
+        return None
+    suffix = f"_tile_{index}" if tile_count > 1 else ""
+    return RowStream(os.path.join(output_dir, f"page_{page_num}{suffix}_rows.jsonl"))
+
+def page_tiles(png: bytes, dpi: int) -> List[bytes]:
+    """The images to send for a page: its row tiles when TILE_PAGES is set, else the page itself"""
+    return split_page(png, dpi) if TILE_PAGES else [png]
+
+def optimize_tile(page_num: int, index: int, tile_count: int, png: bytes, dpi: int):
+    """Shrink a page (or one of its tiles) for the request"""
+    image = optimize_page(png, dpi)
+    label = f"Page {page_num} tile {index}/{tile_count}" if tile_count > 1 else f"Page {page_num}"
+    logger.info(f"{label} image: {describe(image)}")
+    return image
+
+def merge_tile_results(page_num: int, tile_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine the results of a page's tiles, dropping rows extracted from both sides of an overlap"""
+    if len(tile_results) == 1:
+        return tile_results[0]
+    result = {
+        "page": page_num,
+        "data": merge_tile_entries([r["data"] if isinstance(r.get("data"), list) else [] for r in tile_results],
+                                   lambda entry: entry_key(entry, "HS_CODE", "DESCRIPTION")),
+        "tiles": len(tile_results),
+    }
+    failed = [{"tile": index, "error": r["error"]} for index, r in enumerate(tile_results, 1) if "error" in r]
+    if failed:
+        result["failed_tiles"] = failed
+    return result
+
+def process_single_page(pdf_path: str, output_dir: str, page_num: int):
+    """Process a single page of the PDF"""
     try:
-        client = Anthropic(api_key=ANTHROPIC_API_KEY)
+        # Render specific page of PDF, split it into tiles if enabled and shrink them for the request
+        tiles = page_tiles(render_page(pdf_path, page_num), DEFAULT_DPI)
         
-        # Encode the image
-        base64_image = encode_image_to_base64(image)
+        # Process the page (its tiles concurrently)
+        def process_tile(index_png):
+            index, png = index_png
+            image = optimize_tile(page_num, index, len(tiles), png, DEFAULT_DPI)
+            return process_page(page_num, image.data, image.media_type,
+                                row_stream(output_dir, page_num, index, len(tiles)))
         
-        # Prepare the prompt for Claude
-        prompt = f"""
-        This image shows a page from a tariff schedule. Extract the data into a JSON array of objects with the following properties:
-        "HS_CODE", "DESCRIPTION", "DUTY_RATE", "EFTA", "SG", "USA"
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(tiles)) as executor:
+            result = merge_tile_results(page_num, list(executor.map(process_tile, enumerate(tiles, 1))))
         
-        Notes:
-        - Extract all rows visible in this tariff table.
-        - HS_CODE is usually formatted as numbers with dots (e.g., 01.01, 0101.21.00)
-        - DESCRIPTION contains product descriptions
-        - DUTY_RATE is usually a percentage
-        - EFTA, SG, and USA columns contain preferential rates or exemption codes
-        - If a field is empty or not applicable, use an empty string ""
-        - Make sure to return a valid JSON array of objects
-        
-        ONLY RESPOND WITH THE JSON AND NO OTHER TEXT!!!
-        """
-        
-        # Make the API call
-        response = client.messages.create(
-            model=MODEL,
-            max_tokens=4000,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": base64_image}}
-                    ]
-                }
-            ]
-        )
-        
-        # Get the response text
-        response_text = response.content[0].text.strip()
+        # Save individual page result
+        save_page_result(output_dir, page_num, result)
+        return result
         
-        # If the response starts with ``` and ends with ```, strip those out
-        if response_text.startswith('```') and response_text.endswith('```'):
-            if response_text.startswith('```json'):
-                response_text = response_text[7:-3].strip()
-            else:
-                response_text = response_text[3:-3].strip()
-                
-        try:
-            # Try to parse the response as JSON
-            result = json.loads(response_text)
-            logger.info(f"Successfully processed page {page_num}")
-            return {"page": page_num, "data": result}
-        except json.JSONDecodeError:
-            # Try to fix common JSON issues
-            # Sometimes the response might have comments or trailing commas
-            try:
-                # Remove potential trailing commas before closing brackets
-                response_text = response_text.replace(',]', ']').replace(',}', '}')
-                result = json.loads(response_text)
-                logger.info(f"Successfully processed page {page_num} after fixing JSON")
-                return {"page": page_num, "data": result}
-            except json.JSONDecodeError:
-                # If still not valid JSON, return the raw text
-                logger.warning(f"Response for page {page_num} was not valid JSON. Raw response: {response_text[:100]}...")
-                return {"page": page_num, "error": "Invalid JSON response", "raw_response": response_text}
-            
     except Exception as e:
         logger.error(f"Error processing page {page_num}: {str(e)}")
         return {"page": page_num, "error": str(e)}
 
-def process_single_page(pdf_path: str, output_dir: str, page_num: int):
-    """Process a single page of the PDF"""
+async def process_single_page_async(output_dir: str, page_num: int, limiter: RateLimiter,
+                                    renderer: PageRenderer):
+    """Process a single page, waiting on the shared rate limiter only for the API calls"""
     try:
-        # Convert specific page of PDF to image
-        images = convert_from_path(pdf_path, first_page=page_num, last_page=page_num)
-        
-        if not images:
-            logger.error(f"No image generated for page {page_num}")
-            return None
-        
-        # Process the page
-        result = process_page(page_num, images[0])
-        
-        # Save individual page result
-        output_file = os.path.join(output_dir, f"page_{page_num}_result.json")
-        with open(output_file, "w") as f:
-            json.dump(result, f, indent=4)
-        
-        logger.info(f"Saved result for page {page_num} to {output_file}")
+        png = await renderer.render_async(page_num)
+        tiles = await asyncio.to_thread(page_tiles, png, renderer.dpi)
+
+        async def process_tile(index, tile_png):
+            image = await asyncio.to_thread(optimize_tile, page_num, index, len(tiles), tile_png, renderer.dpi)
+            return await process_page_async(page_num, image.data, image.media_type, limiter,
+                                            row_stream(output_dir, page_num, index, len(tiles)))
+
+        # The tiles of a page run concurrently, each paced by the rate limiter
+        tile_results = await asyncio.gather(*(process_tile(index, tile_png)
+                                              for index, tile_png in enumerate(tiles, 1)))
+        result = merge_tile_results(page_num, tile_results)
+
+        save_page_result(output_dir, page_num, result)
         return result
-        
+
     except Exception as e:
         logger.error(f"Error processing page {page_num}: {str(e)}")
         return {"page": page_num, "error": str(e)}
 
-def process_pdf(pdf_path: str, output_dir: str, start_page: int = 1, end_page: int = None):
-    """Process PDF pages sequentially or with limited parallelism"""
+def process_pdf(pdf_path: str, output_dir: str, start_page: int = 1, end_page: int = None,
+                limiter: RateLimiter = None, concurrency: int = MAX_WORKERS):
+    """Process PDF pages concurrently, paced by the requests/tokens per minute quota"""
     try:
         # Determine total pages in the PDF
         import PyPDF2
@@ -146,30 +186,18 @@ def process_pdf(pdf_path: str, output_dir: str, start_page: int = 1, end_page: i
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
         
-        results = []
-        
-        # Process pages with limited concurrency to avoid memory issues
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-            # Submit tasks for each page in the range
-            future_to_page = {
-                executor.submit(process_single_page, pdf_path, output_dir, page_num): page_num
-                for page_num in range(start_page, end_page + 1)
-            }
-            
-            # Process completed tasks
-            for future in concurrent.futures.as_completed(future_to_page):
-                page_num = future_to_page[future]
-                try:
-                    result = future.result()
-                    if result:
-                        results.append(result)
-                    logger.info(f"Completed processing page {page_num}/{end_page}")
-                    
-                    # Random backoff to avoid rate limiting
-                    time.sleep(random.uniform(2.0, 5.0))
-                    
-                except Exception as e:
-                    logger.error(f"Error with page {page_num}: {str(e)}")
+        limiter = limiter or RateLimiter(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)
+
+        # Render workers keep the PDF open; only the pages in flight are held in memory
+        with PageRenderer(pdf_path) as renderer:
+            async def process(page_num):
+                result = await process_single_page_async(output_dir, page_num, limiter, renderer)
+                logger.info(f"Completed processing page {page_num}/{end_page}")
+                return result
+
+            page_results = asyncio.run(run_pipeline(range(start_page, end_page + 1), process, concurrency))
+        results = [result for result in page_results if result]
+        logger.info(f"Waited {limiter.waited:.1f}s on the rate limit")
         
         # Combine results for the processed range
         combine_results(output_dir, start_page, end_page)
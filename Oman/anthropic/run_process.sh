@@ -5,6 +5,8 @@ LOG_FILE="/home/computeruse/test_data/Oman/anthropic/processing.log"
 
 echo "Starting OCR processing at $(date)" > "$LOG_FILE"
 cd /home/computeruse/test_data/Oman/anthropic
+# The scripts import the shared pipeline modules (vision_pipeline.py, extraction_backend.py, ...) from Oman/
+export PYTHONPATH="/home/computeruse/test_data/Oman${PYTHONPATH:+:$PYTHONPATH}"
 
 # Run the processing script, redirecting all output to the log file
 nohup python3 run_all.py >> "$LOG_FILE" 2>&1 &
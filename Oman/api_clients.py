@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Shared, pooled API clients for every extraction entry point.
+
+The OpenAI scripts used the SDK's module-global client. The Anthropic script
+built a new Anthropic() per page, so every request paid for a new connection
+pool, TCP connect and TLS handshake. openai_client() and anthropic_client()
+instead return one client per set of settings for the whole process. Each is
+built on an httpx connection pool of TARFAH_HTTP_POOL_SIZE connections
+(default 32), kept alive for TARFAH_HTTP_KEEPALIVE seconds (default 60), so
+concurrent requests reuse warm connections.
+
+The SDK clients are thread-safe. The async pipelines call them through
+asyncio.to_thread on the executor vision_pipeline.run_pipeline installs,
+which has pipeline_threads(concurrency) workers: one per page in flight plus
+headroom. That is the most requests that can be in flight at once, so the
+pool needs no more connections than that; the scripts with a --concurrency
+option size it with pool_size_for(concurrency). The default pool covers the
+scripts' default concurrency. Clients are created under a lock on first use
+and closed at exit.
+"""
+
+import os
+import atexit
+import threading
+
+from vision_pipeline import pipeline_threads
+
+DEFAULT_POOL_SIZE = int(os.environ.get("TARFAH_HTTP_POOL_SIZE", "32"))
+DEFAULT_KEEPALIVE_SECONDS = float(os.environ.get("TARFAH_HTTP_KEEPALIVE", "60"))
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_MAX_RETRIES = 2
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def http_client(sdk, pool_size=DEFAULT_POOL_SIZE, keepalive=DEFAULT_KEEPALIVE_SECONDS, timeout=DEFAULT_TIMEOUT):
+    """httpx client with a pool of pool_size kept-alive connections, for an SDK module (openai or anthropic)."""
+    import httpx
+
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                          keepalive_expiry=keepalive)
+    # The SDK's own httpx subclass keeps its defaults (redirects, ...); older SDKs lack it
+    client_class = getattr(sdk, "DefaultHttpxClient", httpx.Client)
+    return client_class(limits=limits, timeout=timeout)
+
+
+def pool_size_for(concurrency):
+    """Connections needed by a run_pipeline of concurrency pages: one per worker thread, at least the default."""
+    return max(DEFAULT_POOL_SIZE, pipeline_threads(concurrency))
+
+
+def _shared(settings, create):
+    with _lock:
+        client = _clients.get(settings)
+        if client is None:
+            client = _clients[settings] = create()
+        return client
+
+
+def openai_client(api_key=None, base_url=None, max_retries=DEFAULT_MAX_RETRIES, timeout=DEFAULT_TIMEOUT,
+                  pool_size=DEFAULT_POOL_SIZE):
+    """
+    The process-wide OpenAI client for these settings.
+
+    api_key and base_url default to the SDK's (OPENAI_API_KEY, OPENAI_BASE_URL).
+    """
+    def create():
+        import openai
+        return openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries, timeout=timeout,
+                             http_client=http_client(openai, pool_size, timeout=timeout))
+
+    return _shared(("openai", api_key, base_url, max_retries, timeout, pool_size), create)
+
+
+def anthropic_client(api_key=None, base_url=None, max_retries=DEFAULT_MAX_RETRIES, timeout=DEFAULT_TIMEOUT,
+                     pool_size=DEFAULT_POOL_SIZE):
+    """
+    The process-wide Anthropic client for these settings.
+
+    api_key and base_url default to the SDK's (ANTHROPIC_API_KEY, ANTHROPIC_BASE_URL).
+    """
+    def create():
+        import anthropic
+        return anthropic.Anthropic(api_key=api_key, base_url=base_url, max_retries=max_retries, timeout=timeout,
+                                   http_client=http_client(anthropic, pool_size, timeout=timeout))
+
+    return _shared(("anthropic", api_key, base_url, max_retries, timeout, pool_size), create)
+
+
+@atexit.register
+def close_clients():
+    """Close every shared client and its connections."""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
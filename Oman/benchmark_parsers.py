@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Benchmark the tariff text parsers against tarfah.txt and scaled-up copies of it.
+
+Each parser entry point runs in a fresh interpreter so that peak memory and
+import costs are measured in isolation. Wall time, peak RSS, entry counts and
+entries/sec are written to a JSON report, which can be compared against a
+previous report to catch regressions before a release. Everything runs locally
+on the bundled text; no network access is needed.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+# name: (module, callable). "Class.method" callables are run on a fresh instance.
+PARSERS = {
+    'parse_tariff': ('parse_tariff', 'parse_tariff_file'),
+    'parse_tariff_v2': ('parse_tariff_v2', 'parse_tariff_file'),
+    'parse_tariff_v3': ('parse_tariff_v3', 'parse_tariff_file'),
+    'parse_tariff_v4': ('parse_tariff_v4', 'parse_tariff_file'),
+    'parse_tariff_v5': ('parse_tariff_v5', 'TariffParser.parse_file'),
+    'parse_tariff_final': ('parse_tariff_final', 'parse_tariff_file'),
+    'parse_tariff_final2': ('parse_tariff_final2', 'parse_tariff_file'),
+    'parse_tariff_final3': ('parse_tariff_final3', 'TariffParser.parse_file'),
+    'parse_tariff_final4': ('parse_tariff_final4', 'TariffParser.parse_file'),
+    'parse_final': ('parse_final', 'TariffParser.parse_file'),
+    'process_tariff': ('process_tariff', 'process_file'),
+    'process_tariff_v2': ('process_tariff_v2', 'process_file'),
+    'tariff_parser': ('tariff_parser', 'TariffParser.parse_file'),
+    'tariff_parser_mmap': ('tariff_parser', 'TariffParser.parse_file_mmap'),
+    'tariff_parser_parallel': ('tariff_parser', 'parse_file_parallel'),
+}
+
+DEFAULT_INPUT = "tarfah.txt"
+DEFAULT_SCALES = (1, 10, 50)
+DEFAULT_OUTPUT = "benchmark_results.json"
+DEFAULT_TIMEOUT = 600  # seconds per parser run
+DEFAULT_REPEAT = 3
+# A parser is flagged when it gets this much slower than in the baseline report
+REGRESSION_THRESHOLD = 0.2
+
+
+def _peak_rss_mb(who):
+    """Peak RSS in MB of this process (RUSAGE_SELF) or its largest finished child (RUSAGE_CHILDREN)."""
+    import resource
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(who).ru_maxrss
+    return max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
+
+
+def run_one(name, input_path):
+    """Run one parser in this process and return its measurements."""
+    import resource
+
+    module_name, target = PARSERS[name]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    start = time.perf_counter()
+    module = __import__(module_name)
+    if '.' in target:
+        class_name, method_name = target.split('.')
+        parse = getattr(getattr(module, class_name)(), method_name)
+    else:
+        parse = getattr(module, target)
+    import_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    entries = parse(input_path)
+    wall_time = time.perf_counter() - start
+
+    # Worker processes (the parallel parser's pool) have exited by now and count as children
+    peak_rss_mb = _peak_rss_mb(resource.RUSAGE_SELF)
+    children_peak_rss_mb = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+
+    hs_codes = {entry.get('hs_code') for entry in entries if isinstance(entry, dict)}
+    hs_codes.discard(None)
+    return {
+        'wall_time_s': round(wall_time, 4),
+        'import_time_s': round(import_time, 4),
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'children_peak_rss_mb': round(children_peak_rss_mb, 1),
+        'entries': len(entries),
+        'unique_hs_codes': len(hs_codes),
+        'entries_per_sec': round(len(entries) / wall_time, 1) if wall_time else None,
+    }
+
+
+def run_isolated(name, input_path, timeout):
+    """Run one parser in a child interpreter and collect its result or error."""
+    cmd = [sys.executable, os.path.abspath(__file__), "--run-one", name, "--input", input_path]
+    try:
+        process = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {'error': f"timed out after {timeout}s"}
+
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines()
+        return {'error': lines[-1] if lines else f"exit code {process.returncode}"}
+    # The parsers print progress; the measurements are the last line
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def run_best_of(name, input_path, timeout, repeat):
+    """Run a parser repeat times and keep the fastest run, to damp timing noise."""
+    best = None
+    for _ in range(repeat):
+        result = run_isolated(name, input_path, timeout)
+        if 'error' in result:
+            return result
+        if best is None or result['wall_time_s'] < best['wall_time_s']:
+            best = result
+    return best
+
+
+def make_scaled_input(input_path, scale, work_dir):
+    """Write a synthetic copy of the input repeated scale times."""
+    if scale == 1:
+        return input_path
+    with open(input_path, 'rb') as f:
+        data = f.read()
+    if not data.endswith(b'\n'):
+        data += b'\n'
+    scaled_path = os.path.join(work_dir, f"tarfah_x{scale}.txt")
+    with open(scaled_path, 'wb') as f:
+        for _ in range(scale):
+            f.write(data)
+    return scaled_path
+
+
+def count_lines(path):
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def compare_to_baseline(results, baseline_path, threshold=REGRESSION_THRESHOLD):
+    """Return (parser, scale, old, new) for every run that got slower than the threshold allows."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(r['parser'], r['scale']): r for r in baseline.get('results', [])}
+
+    regressions = []
+    for result in results:
+        old = previous.get((result['parser'], result['scale']))
+        if not old or 'wall_time_s' not in old or 'wall_time_s' not in result:
+            continue
+        if result['wall_time_s'] > old['wall_time_s'] * (1 + threshold):
+            regressions.append((result['parser'], result['scale'], old['wall_time_s'], result['wall_time_s']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tariff text parsers")
+    parser.add_argument("--input", default=DEFAULT_INPUT, help="Tariff text file to parse")
+    parser.add_argument("--parsers", nargs='+', choices=sorted(PARSERS), help="Parsers to run (default: all)")
+    parser.add_argument("--scales", nargs='+', type=int, default=list(DEFAULT_SCALES),
+                        help="Synthetic input sizes as multiples of the input (default: 1 10 50)")
+    parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT, help="Timeout per parser run in seconds")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="Runs per parser and size; the fastest is kept (default: 3)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON report to write")
+    parser.add_argument("--baseline", help="Previous JSON report to check for regressions")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_one(args.run_one, args.input)))
+        return
+
+    names = args.parsers or list(PARSERS)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="tariff_bench_") as work_dir:
+        for scale in args.scales:
+            input_path = make_scaled_input(args.input, scale, work_dir)
+            size = os.path.getsize(input_path)
+            lines = count_lines(input_path)
+            print(f"\n=== {scale}x input: {lines} lines, {size / 1e6:.1f} MB ===")
+
+            for name in names:
+                result = {'parser': name, 'scale': scale, 'input_lines': lines, 'input_bytes': size}
+                result.update(run_best_of(name, input_path, args.timeout, max(1, args.repeat)))
+                results.append(result)
+
+                if 'error' in result:
+                    print(f"{name:24} ERROR: {result['error']}")
+                else:
+                    workers = (f" (+{result['children_peak_rss_mb']:.1f} MB/worker)"
+                               if result.get('children_peak_rss_mb') else "")
+                    print(f"{name:24} {result['wall_time_s']:8.3f}s {result['peak_rss_mb']:8.1f} MB{workers} "
+                          f"{result['entries']:9d} entries {result['entries_per_sec']:12.1f} entries/s")
+
+    report = {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'input': os.path.basename(args.input),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline)
+        for name, scale, old, new in regressions:
+            print(f"REGRESSION: {name} at {scale}x went from {old:.3f}s to {new:.3f}s")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+"""
+Provider-agnostic vision extraction backend.
+
+OpenAIBackend and AnthropicBackend send a page image to their provider and
+return the page in one schema, whatever the provider's own prompt and field
+names:
+
+    {"entries": [{"hs_code", "description_en", "description_ar", "duty_rate",
+                  "efta", "sg", "usa"}, ...],
+     "metadata": [...], "provider": ..., "model": ...}
+
+The entry fields are those of tariff_parser. Both adapters share the response
+cache (with the same keys as the extraction scripts), retries that honour
+Retry-After on 429s, continuation of responses truncated at max_tokens,
+streaming rows to a RowStream, and the structured output mode. Every request,
+retries and continuations included, first waits on the run's RateLimiter. An
+adapter only builds its request and reads the response.
+
+The extraction scripts call extract_page(), which keeps the provider's field
+names; extract() returns the normalized schema.
+
+base_url points an adapter at any compatible endpoint, such as the local
+mock_provider.py, so throughput and concurrency settings can be load-tested
+offline. The response cache is keyed on the request, not the endpoint, so it
+is not used at all when base_url (or OPENAI_BASE_URL / ANTHROPIC_BASE_URL) is
+set: a mock's answers never replace real extractions.
+
+    python mock_provider.py --latency 2 --throttle-rate 0.05 &
+    python extraction_backend.py --provider anthropic --base-url http://127.0.0.1:8765 \\
+        --start 1 --end 100 --concurrency 32
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import asyncio
+import argparse
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+from response_cache import ResponseCache
+from api_clients import openai_client, anthropic_client, pool_size_for, DEFAULT_POOL_SIZE
+from vision_pipeline import run_pipeline, estimate_request_tokens
+from json_rows import RowParser, complete_rows, last_value, rows_after, parse_row
+from extraction_schema import (ENTRY_SYSTEM_PROMPT, ROWS_PROMPT, PAGE_SCHEMA, ROWS_TOOL, ENTRY_KEYS, ROW_KEYS,
+                               response_format, tool_choice, normalize, page_prompt, entries_continuation_prompt,
+                               rows_continuation_prompt)
+
+MAX_RETRIES = 3
+RETRY_DELAY = 2  # seconds, when a failed request gives no Retry-After
+MAX_CONTINUATIONS = 3
+
+# One provider response: its text (or tool input JSON), whether it ran to the
+# end, whether it stopped at max_tokens, and the tokens it used
+Completion = namedtuple("Completion", "text finished truncated usage")
+
+
+def retry_after(error):
+    """Seconds to wait before retrying a failed request: the 429 Retry-After if given, else RETRY_DELAY."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return RETRY_DELAY
+
+
+def parse_document(text):
+    """Parse a response that should be one JSON document, repairing the usual wrapping; None if it is not."""
+    text = text.strip()
+    candidates = [text]
+    candidates += [block.strip() for block in re.findall(r"```(?:json)?\s*([\s\S]*?)\s*```", text)]
+    for opening, closing in ("{}", "[]"):
+        start, end = text.find(opening), text.rfind(closing)
+        if start != -1 and end > start:
+            candidates.append(text[start:end + 1])
+    for candidate in candidates:
+        document = parse_row(candidate)
+        if document is not None:
+            return document
+    return None
+
+
+def page_label(page_num):
+    """How log messages name a page."""
+    return "Page" if page_num is None else f"Page {page_num}"
+
+
+def text_snippet(text, length=200):
+    """The start of a response, for log messages."""
+    return text[:length] + ("..." if len(text) > length else "")
+
+
+class ExtractionBackend(ABC):
+    """
+    Common extraction logic; subclasses implement one provider.
+
+    Subclasses set provider, default_system_prompt, code_field (the provider's
+    HS code field, used to continue truncated responses), rows_key (where the
+    rows array is in a response, None for a bare array) and field_keys
+    (provider field -> normalized field), and implement user_prompt,
+    continuation_prompt, cache_system, create_client and complete.
+    """
+
+    provider = None
+    default_system_prompt = None
+    default_model = None
+    default_max_tokens = 4096
+    api_key_variable = None
+    base_url_variable = None
+    code_field = None
+    rows_key = None
+    field_keys = None
+
+    def __init__(self, model=None, max_tokens=None, base_url=None, api_key=None, structured=False,
+                 cache=None, timeout=120, pool_size=DEFAULT_POOL_SIZE, system_prompt=None, prompt=None, log=print):
+        """
+        Args:
+            model: Model name (default: the adapter's default_model)
+            max_tokens: Response token limit
+            base_url: API endpoint, e.g. a mock_provider.py server (default: the provider's)
+            api_key: API key (default: from the provider's environment variable)
+            structured: Constrain responses with the schemas in extraction_schema.py
+            cache: ResponseCache to read and store responses in, or None; not used with a custom endpoint
+            timeout: Request timeout in seconds
+            pool_size: Connections kept in the shared client's pool (see api_clients.py)
+            system_prompt: System prompt (default: the adapter's default_system_prompt)
+            prompt: User prompt for every page (default: the adapter's prompt for the page)
+            log: Called with progress messages (retries, truncated and unparseable responses)
+        """
+        self.model = model or self.default_model
+        self.max_tokens = max_tokens or self.default_max_tokens
+        self.base_url = base_url
+        self.api_key = api_key or os.environ.get(self.api_key_variable) or ("mock" if base_url else None)
+        self.structured = structured
+        # Cache keys don't cover the endpoint, so responses from anywhere but the
+        # provider's own API (e.g. mock_provider.py) must not be read or stored
+        self.cache = None if base_url or os.environ.get(self.base_url_variable) else cache
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.system_prompt = system_prompt or self.default_system_prompt
+        self.prompt = prompt
+        self.log = log
+        # Counters for load tests, updated from the worker threads
+        self._counter_lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.failures = 0
+
+    # Provider specifics
+
+    @abstractmethod
+    def user_prompt(self, page_num):
+        """The user prompt of a page's first request."""
+
+    @abstractmethod
+    def continuation_prompt(self, page_num, last_code):
+        """The user prompt asking for the rows of a page after the one with HS code last_code."""
+
+    @abstractmethod
+    def cache_system(self):
+        """What besides the user prompt shapes the response, for the cache key."""
+
+    @abstractmethod
+    def create_client(self):
+        """The shared provider client (api_clients.py) for this backend's settings."""
+
+    @abstractmethod
+    def complete(self, image_base64, media_type, prompt, stream=None):
+        """Make one API request and return its Completion; with a stream, feed it the response as it arrives."""
+
+    # Shared logic
+
+    @property
+    def client(self):
+        """The provider client, shared by all threads and every backend with the same settings."""
+        return self.create_client()
+
+    def _count(self, counter):
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def cache_key(self, image_base64, prompt):
+        return self.cache.key(image_base64, self.cache_system(), prompt, self.model, self.max_tokens)
+
+    async def request(self, image_base64, media_type, prompt, limiter=None, stream=None):
+        """
+        Return the Completion for a request, from the cache or the provider.
+
+        Each attempt first waits on limiter, if given, so retries are paced like
+        any other request. The reservation is then settled against the tokens
+        the response used, and a 429 pauses the limiter for its Retry-After.
+        A stream receives the response text, whether cached or streamed from
+        the provider.
+        """
+        key = self.cache_key(image_base64, prompt) if self.cache else None
+        if key:
+            cached = self.cache.get_response(key)
+            if cached is not None:
+                content, truncated = cached
+                if stream is not None:
+                    stream.feed(content)
+                return Completion(content, not truncated, truncated, None)
+
+        reserved = estimate_request_tokens(self.max_tokens)
+        for attempt in range(MAX_RETRIES):
+            if limiter is not None:
+                await limiter.acquire(reserved)
+            if stream is not None and attempt:
+                stream.restart()
+            self._count("requests")
+            try:
+                completion = await asyncio.to_thread(self.complete, image_base64, media_type, prompt, stream)
+                break
+            except Exception as e:
+                throttled = getattr(e, "status_code", None) == 429
+                if throttled:
+                    self._count("throttled")
+                if attempt == MAX_RETRIES - 1:
+                    self._count("failures")
+                    self.log(f"Failed after {MAX_RETRIES} attempts: {e}")
+                    raise
+                delay = retry_after(e)
+                self.log(f"Error: {e}. Retrying in {delay:g}s...")
+                if throttled and limiter is not None:
+                    # A rejected request used no tokens; hold back every request of the run,
+                    # this retry included, until Retry-After has passed
+                    limiter.settle(reserved, 0)
+                    limiter.pause(delay)
+                else:
+                    await asyncio.sleep(delay)
+
+        if limiter is not None:
+            # Return the part of the reservation the response did not use
+            limiter.settle(reserved, completion.usage)
+        if key and (completion.finished or completion.truncated):
+            self.cache.put(key, completion.text, self.model, completion.usage, completion.truncated)
+        return completion
+
+    def parse(self, text):
+        """
+        Page data (provider rows under "entries") of a complete response.
+
+        A response that is not valid JSON keeps the rows that parse on their own.
+        """
+        document = parse_document(text)
+        if isinstance(document, list):
+            return {"entries": document}
+        rows_key = self.rows_key or "rows"
+        if isinstance(document, dict) and isinstance(document.get(rows_key), list):
+            page = dict(document)
+            page["entries"] = page.pop(rows_key)
+            return page
+        if isinstance(document, dict):
+            return document
+        parser = RowParser(self.rows_key)
+        parser.feed(text)
+        if parser.rows:
+            return {"entries": parser.rows, "malformed_entries": parser.malformed}
+        return {"raw_content": text, "parsing_error": "Failed to parse JSON from the response"}
+
+    async def continue_truncated(self, image_base64, media_type, page_num, text, limiter=None, stream=None):
+        """
+        Salvage the complete rows of a truncated response and request the rest of the page.
+
+        Each continuation asks only for the rows after the last HS code received,
+        up to MAX_CONTINUATIONS times; the page is marked "truncated" if it still
+        was not finished. Continuation rows are added to the stream, if any.
+        """
+        rows = stream.rows if stream is not None else complete_rows(text, self.rows_key)
+        self.log(f"{page_label(page_num)} response truncated at max_tokens, salvaged {len(rows)} rows")
+        continuations = 0
+        truncated = True
+        while truncated and continuations < MAX_CONTINUATIONS:
+            last_code = last_value(rows, self.code_field)
+            if not last_code:
+                break
+            completion = await self.request(image_base64, media_type, self.continuation_prompt(page_num, last_code),
+                                            limiter)
+            continuations += 1
+            truncated = completion.truncated
+            if truncated:
+                new_rows = complete_rows(completion.text, self.rows_key)
+            else:
+                new_rows = self.parse(completion.text).get("entries")
+                if not isinstance(new_rows, list):
+                    # Unparseable continuation: keep what was salvaged
+                    truncated = True
+                    break
+            new_rows = rows_after(new_rows, self.code_field, last_code)
+            self.log(f"{page_label(page_num)} continuation {continuations} after {last_code}: {len(new_rows)} rows")
+            if not new_rows:
+                break
+            rows.extend(new_rows)
+            if stream is not None:
+                stream.add(new_rows)
+
+        page = {"entries": rows, "continuations": continuations}
+        if truncated:
+            page["truncated"] = True
+        return page
+
+    async def extract_page(self, image_base64, media_type="image/png", page_num=None, limiter=None, stream=None):
+        """
+        Extract a page image, keeping the provider's field names.
+
+        Returns {"entries": [...], ...}, or {"error": ...} when the request fails.
+        With a stream, rows are parsed and written as the response arrives, so a
+        malformed row costs that row instead of the page.
+        """
+        try:
+            completion = await self.request(image_base64, media_type, self.user_prompt(page_num), limiter, stream)
+            if completion.truncated:
+                return await self.continue_truncated(image_base64, media_type, page_num, completion.text,
+                                                     limiter, stream)
+        except Exception as e:
+            return {"error": str(e)}
+        page = self.parse(completion.text)
+        if "malformed_entries" in page:
+            self.log(f"{page_label(page_num)}: response is not valid JSON, kept {len(page['entries'])} rows, "
+                     f"skipped {page['malformed_entries']} malformed")
+        elif "parsing_error" in page:
+            self.log(f"{page_label(page_num)}: failed to parse the response: {text_snippet(completion.text)}")
+        return page
+
+    async def extract(self, image_base64, media_type="image/png", page_num=None, limiter=None):
+        """
+        Extract a page image into the normalized schema.
+
+        Returns {"error": ...} (with provider and model) when the request fails.
+        """
+        page = await self.extract_page(image_base64, media_type, page_num, limiter)
+        if isinstance(page.get("entries"), list):
+            page["entries"] = [normalize(row, self.field_keys) for row in page["entries"] if isinstance(row, dict)]
+        page.update(provider=self.provider, model=self.model)
+        return page
+
+
+class OpenAIBackend(ExtractionBackend):
+    """Chat completions with an image_url part; the prompts of multimodal_tariff_processor."""
+
+    provider = "openai"
+    default_system_prompt = ENTRY_SYSTEM_PROMPT
+    default_model = "gpt-4o"
+    default_max_tokens = 4096
+    api_key_variable = "OPENAI_API_KEY"
+    base_url_variable = "OPENAI_BASE_URL"
+    code_field = "H.S. Code"
+    rows_key = "entries"
+    field_keys = ENTRY_KEYS
+
+    def user_prompt(self, page_num):
+        return self.prompt or page_prompt(page_num)
+
+    def continuation_prompt(self, page_num, last_code):
+        return entries_continuation_prompt(self.user_prompt(page_num), last_code)
+
+    def cache_system(self):
+        return [self.system_prompt, PAGE_SCHEMA] if self.structured else self.system_prompt
+
+    def create_client(self):
+        # Retries are ours, so 429s are counted and Retry-After is honoured once
+        return openai_client(self.api_key, self.base_url, max_retries=0, timeout=self.timeout,
+                             pool_size=self.pool_size)
+
+    def complete(self, image_base64, media_type, prompt, stream=None):
+        request = dict(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": f"data:{media_type};base64,{image_base64}"}},
+                ]},
+            ],
+            max_tokens=self.max_tokens,
+        )
+        if self.structured:
+            request["response_format"] = response_format()
+        if stream is None:
+            response = self.client.chat.completions.create(**request)
+            choice = response.choices[0]
+            text, finish_reason, usage = choice.message.content or "", choice.finish_reason, response.usage
+        else:
+            parts = []
+            finish_reason = usage = None
+            for chunk in self.client.chat.completions.create(**request, stream=True,
+                                                             stream_options={"include_usage": True}):
+                if chunk.usage:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    stream.feed(delta)
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+            text = "".join(parts)
+        return Completion(text, finish_reason == "stop", finish_reason == "length",
+                          usage.total_tokens if usage else None)
+
+
+class AnthropicBackend(ExtractionBackend):
+    """Messages API with a base64 image block; the prompt of anthropic/process_tarfah.py."""
+
+    provider = "anthropic"
+    default_model = "claude-3-7-sonnet-20250219"
+    default_max_tokens = 4000
+    api_key_variable = "ANTHROPIC_API_KEY"
+    base_url_variable = "ANTHROPIC_BASE_URL"
+    code_field = "HS_CODE"
+    # A bare array, or {"rows": [...]} as tool input
+    rows_key = None
+    field_keys = ROW_KEYS
+
+    def user_prompt(self, page_num):
+        return self.prompt or ROWS_PROMPT
+
+    def continuation_prompt(self, page_num, last_code):
+        return rows_continuation_prompt(last_code, self.user_prompt(page_num))
+
+    def cache_system(self):
+        return ROWS_TOOL if self.structured else None
+
+    def create_client(self):
+        return anthropic_client(self.api_key, self.base_url, max_retries=0, timeout=self.timeout,
+                                pool_size=self.pool_size)
+
+    def complete(self, image_base64, media_type, prompt, stream=None):
+        request = dict(
+            model=self.model,
+            max_tokens=self.max_tokens,
+            messages=[{"role": "user", "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": image_base64}},
+            ]}],
+        )
+        if self.structured:
+            request.update(tools=[ROWS_TOOL], tool_choice=tool_choice())
+        if stream is None:
+            response = self.client.messages.create(**request)
+            text = "".join(block.text for block in response.content if block.type == "text")
+            for block in response.content:
+                if block.type == "tool_use":
+                    text = json.dumps(block.input, ensure_ascii=False)
+        else:
+            with self.client.messages.stream(**request) as message_stream:
+                for event in message_stream:
+                    if event.type == "text":
+                        stream.feed(event.text)
+                    elif event.type == "input_json":
+                        stream.feed(event.partial_json)
+                response = message_stream.get_final_message()
+            text = stream.parser.text
+        return Completion(text, response.stop_reason in ("end_turn", "tool_use"), response.stop_reason == "max_tokens",
+                          response.usage.input_tokens + response.usage.output_tokens)
+
+
+BACKENDS = {"openai": OpenAIBackend, "anthropic": AnthropicBackend}
+
+
+def make_backend(provider, **options):
+    """Backend for provider ('openai' or 'anthropic'); options are passed to its constructor."""
+    try:
+        backend_class = BACKENDS[provider]
+    except KeyError:
+        raise ValueError(f"Unknown provider {provider!r}, expected one of {sorted(BACKENDS)}")
+    return backend_class(**options)
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def extract_pages(backend, pages, load_image, limiter, concurrency):
+    """
+    Extract pages concurrently, paced by limiter; returns the page results in page order.
+
+    load_image(page_num) returns (image bytes, media type) and runs in a worker thread.
+    """
+    async def process(page_num):
+        image, media_type = await asyncio.to_thread(load_image, page_num)
+        image_base64 = base64.b64encode(image).decode("utf-8")
+        started = time.perf_counter()
+        page = await backend.extract(image_base64, media_type, page_num, limiter)
+        page.update(page_number=page_num, seconds=round(time.perf_counter() - started, 3))
+        return page
+
+    return await run_pipeline(pages, process, concurrency)
+
+
+def main():
+    from vision_pipeline import RateLimiter, add_rate_limit_arguments
+
+    parser = argparse.ArgumentParser(description="Extract pages through a provider backend, reporting throughput")
+    parser.add_argument("--provider", choices=sorted(BACKENDS), default="openai", help="Provider adapter")
+    parser.add_argument("--model", help="Model (default: the adapter's)")
+    parser.add_argument("--base-url", help="API endpoint, e.g. http://127.0.0.1:8765 for mock_provider.py")
+    parser.add_argument("--pdf", default="tarfah.pdf", help="Path to the PDF file")
+    parser.add_argument("--image", help="Send this image for every page instead of rendering the PDF")
+    parser.add_argument("--start", type=int, default=1, help="First page")
+    parser.add_argument("--end", type=int, help="Last page (default: --start)")
+    parser.add_argument("--structured", action="store_true", help="Use schema-constrained responses")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Don't read or store responses in the response cache (never used with --base-url)")
+    parser.add_argument("--output", help="Write the normalized page results to this JSON file")
+    add_rate_limit_arguments(parser)
+    args = parser.parse_args()
+
+    backend = make_backend(args.provider, model=args.model, base_url=args.base_url, structured=args.structured,
+                           cache=None if args.no_cache else ResponseCache(),
+                           # A connection per pipeline thread, so no request waits for a free connection
+                           pool_size=pool_size_for(args.concurrency))
+    pages = range(args.start, (args.end or args.start) + 1)
+    limiter = RateLimiter(args.rpm, args.tpm)
+
+    started = time.perf_counter()
+    if args.image:
+        with open(args.image, "rb") as f:
+            data = f.read()
+        media_type = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp"}.get(
+            args.image.rsplit(".", 1)[-1].lower(), "image/png")
+        results = asyncio.run(extract_pages(backend, pages, lambda page_num: (data, media_type), limiter,
+                                            args.concurrency))
+    else:
+        from page_renderer import PageRenderer
+        from image_optimizer import prepare_page_image
+
+        with PageRenderer(args.pdf) as renderer:
+            def load_image(page_num):
+                image = prepare_page_image(renderer.render(page_num), renderer.dpi)
+                return image.data, image.media_type
+
+            results = asyncio.run(extract_pages(backend, pages, load_image, limiter, args.concurrency))
+    elapsed = time.perf_counter() - started
+
+    latencies = [page["seconds"] for page in results if "error" not in page]
+    failed = sum("error" in page for page in results)
+    entries = sum(len(page.get("entries") or []) for page in results)
+    print(f"{len(results)} pages in {elapsed:.1f}s ({len(results) / elapsed * 60:.0f} pages/min), "
+          f"{entries} entries, {failed} failed")
+    print(f"{backend.requests} requests, {backend.throttled} throttled (429), {backend.failures} failed after retries")
+    print(f"{limiter.waited:.1f}s waiting on the rate limit, "
+          f"page latency p50 {_percentile(latencies, 0.5):.2f}s, p95 {_percentile(latencies, 0.95):.2f}s")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
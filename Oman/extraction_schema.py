@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Prompts, JSON schemas and the normalized record of the vision extraction.
+
+The prompts describe the JSON shape in prose, and the scripts then repair what
+comes back (code blocks, brace slicing, trailing commas). With a schema the
+provider constrains the output itself: OpenAI through a strict json_schema
+response_format, Anthropic through a forced tool call whose input is the rows.
+A complete response is then one JSON document that parses with json.loads.
+
+The OpenAI scripts and the Anthropic script ask for different field names;
+normalize() maps either to the tariff_parser field names.
+"""
+
+import json
+import argparse
+
+ENTRY_SYSTEM_PROMPT = """
+You are a data extraction specialist focusing on Oman's Customs Tariff tables. Your task is to extract ALL columns from the tables with high precision.
+
+For each entry in the table, extract these exact fields:
+- H.S. Code: The tariff code in the rightmost column (e.g., "01.01", "01 01 21 00 10", "25.03")
+- Description in English: The column with English product descriptions
+- Description in Arabic: The column with Arabic product descriptions
+- Duty Rate: The percentage value (e.g., "0%", "5%", "PROHIBITED") - this should ALWAYS go in the Duty Rate field
+- SFTA: The leftmost indicator column, usually contains A, B, C, etc.
+- SG: The second indicator column from left
+- URA: The third indicator column from left (before the duty rate)
+
+IMPORTANT RULES:
+1. Duty Rate should NEVER be placed in the SFTA, SG or URA fields
+2. The indicator columns (SFTA, SG, URA) should contain only single character values like "A", "B", "+", "-" etc.
+3. Don't mix up numerical percentages (0%, 5%) with letter indicators (A, B, C)
+4. Be careful about right-to-left text in the Arabic column
+5. If a field is empty, use null, not an empty string
+6. Include ALL lines from the table, including headings and subheadings
+
+If a page has section headers, chapter headings, or notes, include those in a separate "metadata" section.
+
+Return the data in a structured JSON format with all the fields. Do not include any explanatory text, only the JSON.
+If a page doesn't contain tariff table data, return an empty entries array with a message.
+"""
+
+ROWS_PROMPT = """
+This image shows a page from a tariff schedule. Extract the data into a JSON array of objects with the following properties:
+"HS_CODE", "DESCRIPTION", "DUTY_RATE", "EFTA", "SG", "USA"
+
+Notes:
+- Extract all rows visible in this tariff table.
+- HS_CODE is usually formatted as numbers with dots (e.g., 01.01, 0101.21.00)
+- DESCRIPTION contains product descriptions
+- DUTY_RATE is usually a percentage
+- EFTA, SG, and USA columns contain preferential rates or exemption codes
+- If a field is empty or not applicable, use an empty string ""
+- Make sure to return a valid JSON array of objects
+
+ONLY RESPOND WITH THE JSON AND NO OTHER TEXT!!!
+"""
+
+
+def page_prompt(page_num):
+    """User prompt of the OpenAI scripts for one page."""
+    return f"Extract ALL columns of tariff data from page {page_num} of Oman's Customs Tariff document. Return the results as a JSON object with an 'entries' array. Each entry should include the H.S. Code, English description, Arabic description, duty rate, and the SFTA, SG, and URA indicators."
+
+
+def entries_continuation_prompt(prompt, last_code):
+    """An entries prompt (e.g. page_prompt) for the rest of a page whose previous response was cut off after last_code."""
+    return (prompt +
+            f" A previous response was cut off after the entry with H.S. Code {last_code}: return ONLY the entries"
+            f" that come after that entry on the page, in the same format, without metadata.")
+
+
+def rows_continuation_prompt(last_code, prompt=ROWS_PROMPT):
+    """A rows prompt (ROWS_PROMPT by default) for the rest of a page whose previous response was cut off after last_code."""
+    return prompt + f"""
+A previous response was cut off after the row with HS_CODE {last_code}.
+Return ONLY the rows that come after that row, as a JSON array in the same format.
+"""
+
+
+# Entry fields of the OpenAI scripts, in column order
+ENTRY_FIELDS = {
+    "H.S. Code": "Tariff code from the rightmost column, e.g. \"01.01\" or \"01 01 21 00 10\"",
+    "Description in English": "English product description",
+    "Description in Arabic": "Arabic product description",
+    "Duty Rate": "Duty rate, e.g. \"0%\", \"5%\" or \"PROHIBITED\"; never an indicator letter",
+    "SFTA": "Leftmost indicator column, a single character such as \"A\" or \"+\"",
+    "SG": "Second indicator column from the left, a single character",
+    "URA": "Third indicator column from the left (before the duty rate), a single character",
+}
+
+# Row fields of anthropic/process_tarfah.py
+ROW_FIELDS = {
+    "HS_CODE": "Tariff code, e.g. \"01.01\" or \"0101.21.00\"",
+    "DESCRIPTION": "Product description",
+    "DUTY_RATE": "Duty rate, usually a percentage",
+    "EFTA": "EFTA preferential rate or exemption code",
+    "SG": "SG preferential rate or exemption code",
+    "USA": "USA preferential rate or exemption code",
+}
+
+# Field names of tariff_parser entries, used for every provider's results
+NORMALIZED_FIELDS = ("hs_code", "description_en", "description_ar", "duty_rate", "efta", "sg", "usa")
+# Provider field -> normalized field (the OpenAI indicator columns are the EFTA/SG/USA ones, see tariff_pdf_layout)
+ENTRY_KEYS = dict(zip(ENTRY_FIELDS, NORMALIZED_FIELDS))
+ROW_KEYS = dict(zip(ROW_FIELDS, ("hs_code", "description_en", "duty_rate", "efta", "sg", "usa")))
+
+
+def normalize(record, keys):
+    """Map a provider record to NORMALIZED_FIELDS; empty cells ("" or missing) become None."""
+    normalized = dict.fromkeys(NORMALIZED_FIELDS)
+    for key, field in keys.items():
+        value = record.get(key)
+        if isinstance(value, str):
+            value = value.strip() or None
+        normalized[field] = value
+    return normalized
+
+
+def record_schema(fields, nullable=True):
+    """Strict object schema with every field required (null, or "" when not nullable, for empty cells)."""
+    field_type = ["string", "null"] if nullable else "string"
+    return {
+        "type": "object",
+        "properties": {name: {"type": field_type, "description": description}
+                       for name, description in fields.items()},
+        "required": list(fields),
+        "additionalProperties": False,
+    }
+
+
+PAGE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "entries": {"type": "array", "items": record_schema(ENTRY_FIELDS)},
+        "metadata": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "Section headers, chapter headings and notes on the page",
+        },
+    },
+    "required": ["entries", "metadata"],
+    "additionalProperties": False,
+}
+
+ROWS_TOOL = {
+    "name": "record_tariff_rows",
+    "description": "Record every row of the tariff table on the page, top to bottom.",
+    "input_schema": {
+        "type": "object",
+        "properties": {"rows": {"type": "array", "items": record_schema(ROW_FIELDS, nullable=False)}},
+        "required": ["rows"],
+    },
+}
+
+
+def response_format(schema=PAGE_SCHEMA, name="tariff_page"):
+    """OpenAI response_format that constrains the response to schema."""
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+def tool_choice(tool=ROWS_TOOL):
+    """Anthropic tool_choice forcing a call to tool."""
+    return {"type": "tool", "name": tool["name"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the extraction schemas")
+    parser.add_argument("--anthropic", action="store_true", help="Print the Anthropic tool instead of the OpenAI schema")
+    args = parser.parse_args()
+    print(json.dumps(ROWS_TOOL if args.anthropic else response_format(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Shrink rendered page images before they are base64-encoded into a vision request.
+
+Pages are rendered as full-colour 200 DPI PNGs, which makes requests large and
+slow to upload and drives image-token cost. optimize_page turns one into a
+smaller image that keeps the table legible:
+
+- grayscale (or bilevel) instead of RGB: the tariff tables are black on white;
+- auto-crop of the blank margins around the ink;
+- downsampling to the lowest DPI at which the smallest text line on the page
+  stays MIN_TEXT_HEIGHT_PX tall, so sparse large-print pages shrink the most
+  and dense small-print tables keep the full render resolution;
+- PNG, lossless WebP or (grayscale only) JPEG, whichever is smallest. All of
+  them are only encoded for the first page of a run; later pages reuse the
+  winning format, since the pages of the tariff compress alike.
+
+`python image_optimizer.py --evaluate` checks extraction accuracy against the
+text layer of reference pages, for the original and the optimized images.
+"""
+
+import io
+import os
+import argparse
+from collections import namedtuple
+
+from PIL import Image
+
+MODES = ("gray", "bilevel")
+# Grayscale values darker than this count as ink
+INK_THRESHOLD = 160
+# Blank border kept around the ink when cropping, in points
+CROP_PADDING_PT = 12
+# A row is text when its ink coverage exceeds the page's background rows by this much
+# (background rows still cross the table's vertical rules)
+TEXT_ROW_COVERAGE = 0.01
+# Runs of ink rows shorter than this (in points) are rules, not text
+MIN_TEXT_RUN_PT = 3
+# Smallest text line height, in pixels, to keep after downsampling
+MIN_TEXT_HEIGHT_PX = 18
+MIN_DPI = 100
+JPEG_QUALITY = 85
+
+MEDIA_TYPES = {"PNG": "image/png", "WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+# Image mode ("L" or "1") -> format picked by encode_smallest on the first page of the run
+_page_formats = {}
+
+OptimizedImage = namedtuple("OptimizedImage", "data media_type format dpi original_size")
+
+
+def describe(image):
+    """One-line size report for an optimized page image."""
+    saved = 1 - len(image.data) / image.original_size if image.original_size else 0
+    return (f"{image.original_size / 1024:.0f} KB -> {len(image.data) / 1024:.0f} KB "
+            f"({saved:.0%} smaller, {image.format.lower()}, {image.dpi} dpi)")
+
+
+def extension(image):
+    return "jpg" if image.format == "JPEG" else image.format.lower()
+
+
+def _row_coverage(ink):
+    """Fraction of inked pixels in each row of a mode 'L' ink mask (255 = ink)."""
+    column = ink.resize((1, ink.height), Image.BOX)
+    return [value / 255 for value in column.tobytes()]
+
+
+def _ink_mask(gray):
+    return gray.point(lambda value: 255 if value < INK_THRESHOLD else 0)
+
+
+def crop_to_ink(gray, dpi):
+    """Crop the blank margins, keeping CROP_PADDING_PT around the ink."""
+    box = _ink_mask(gray).getbbox()
+    if not box:
+        return gray
+    padding = round(CROP_PADDING_PT * dpi / 72)
+    left, top, right, bottom = box
+    return gray.crop((max(0, left - padding), max(0, top - padding),
+                      min(gray.width, right + padding), min(gray.height, bottom + padding)))
+
+
+def text_rows(gray, dpi):
+    """
+    (top, bottom) pixel rows of each text line on a grayscale page, top first.
+
+    Text lines are runs of rows whose ink coverage stands out from the page's
+    background rows; very short runs are table rules.
+    """
+    coverage = _row_coverage(_ink_mask(gray))
+    background = sorted(coverage)[len(coverage) // 10]
+    min_run = MIN_TEXT_RUN_PT * dpi / 72
+
+    rows = []
+    start = None
+    for y, value in enumerate(coverage + [0.0]):
+        if value > background + TEXT_ROW_COVERAGE:
+            if start is None:
+                start = y
+        elif start is not None:
+            if y - start >= min_run:
+                rows.append((start, y))
+            start = None
+    return rows
+
+
+def smallest_text_height(gray, dpi):
+    """Height in pixels of the smaller text lines on the page (lower quartile), or None."""
+    heights = sorted(bottom - top for top, bottom in text_rows(gray, dpi))
+    if not heights:
+        return None
+    return heights[len(heights) // 4]
+
+
+def choose_dpi(gray, dpi):
+    """Lowest DPI (in steps of 10, at least MIN_DPI) that keeps the small print legible."""
+    text_height = smallest_text_height(gray, dpi)
+    if not text_height:
+        return dpi
+    target = dpi * MIN_TEXT_HEIGHT_PX / text_height
+    target = -(-target // 10) * 10
+    return int(min(dpi, max(MIN_DPI, target)))
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == "PNG":
+        image.save(buffer, format="PNG", optimize=True)
+    elif fmt == "WEBP":
+        image.convert("L").save(buffer, format="WEBP", lossless=True)
+    else:
+        image.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def encode_smallest(image):
+    """Encode in every suitable format and return (format, bytes) of the smallest."""
+    formats = ["PNG", "WEBP"]
+    # JPEG smears bilevel edges; lossy is only worth trying on grayscale
+    if image.mode == "L":
+        formats.append("JPEG")
+    return min(((fmt, _encode(image, fmt)) for fmt in formats), key=lambda candidate: len(candidate[1]))
+
+
+def encode_page(image):
+    """
+    Encode a page in the format picked for its mode and return (format, bytes).
+
+    The first page of each mode is measured with encode_smallest; every later
+    page is encoded once, in that format.
+    """
+    fmt = _page_formats.get(image.mode)
+    if fmt is None:
+        fmt, data = encode_smallest(image)
+        _page_formats[image.mode] = fmt
+        return fmt, data
+    return fmt, _encode(image, fmt)
+
+
+def optimize_page(png, dpi, mode="gray"):
+    """
+    Optimize a rendered page.
+
+    Args:
+        png: PNG bytes as rendered by page_renderer
+        dpi: Resolution the page was rendered at
+        mode: 'gray' or 'bilevel'
+
+    Returns:
+        OptimizedImage with the encoded bytes, media type, format and effective DPI
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown image mode {mode!r}, expected one of {MODES}")
+    gray = Image.open(io.BytesIO(png)).convert("L")
+    gray = crop_to_ink(gray, dpi)
+
+    target_dpi = choose_dpi(gray, dpi)
+    if target_dpi < dpi:
+        scale = target_dpi / dpi
+        gray = gray.resize((max(1, round(gray.width * scale)), max(1, round(gray.height * scale))),
+                           Image.LANCZOS)
+
+    image = gray.point(lambda value: 255 if value >= INK_THRESHOLD else 0, mode="1") if mode == "bilevel" else gray
+    fmt, data = encode_page(image)
+    return OptimizedImage(data, MEDIA_TYPES[fmt], fmt, target_dpi, len(png))
+
+
+def prepare_page_image(png, dpi, optimize=True, mode="gray"):
+    """The image to send for a rendered page: optimized, or the PNG as rendered."""
+    if optimize:
+        return optimize_page(png, dpi, mode)
+    return OptimizedImage(png, "image/png", "PNG", dpi, len(png))
+
+
+def _recall(reference, page_data):
+    """Share of reference (HS code, duty rate) pairs found in a vision result."""
+    found = set()
+    for entry in page_data.get("entries") or []:
+        code = "".join(ch for ch in str(entry.get("H.S. Code") or "") if ch.isdigit())
+        rate = str(entry.get("Duty Rate") or "").replace(" ", "").upper()
+        found.add((code, rate))
+    pairs = {(entry["hs_code"], (entry["duty_rate"] or "").replace(" ", "").upper()) for entry in reference}
+    return len(pairs & found) / len(pairs) if pairs else None
+
+
+def evaluate(pdf_path, pages, dpi, mode):
+    """
+    Compare extraction accuracy of original and optimized images on reference pages.
+
+    The text layer (tariff_pdf_layout) is the reference, so pages must have one.
+    Makes two vision requests per page (unless the responses are cached).
+    """
+    import base64
+    from page_renderer import render_page
+    from tariff_pdf_layout import extract_page_entries
+    from multimodal_tariff_processor import extract_table_data_from_image
+
+    print(f"{'page':>5} {'entries':>8} {'original':>9} {'optimized':>10}  payload")
+    for page_num in pages:
+        reference = extract_page_entries(pdf_path, page_num)
+        if not reference:
+            print(f"{page_num:>5}  no text layer entries, skipped")
+            continue
+        png = render_page(pdf_path, page_num, dpi)
+        scores = []
+        for image in (prepare_page_image(png, dpi, optimize=False), optimize_page(png, dpi, mode)):
+            page_data = extract_table_data_from_image(base64.b64encode(image.data).decode("utf-8"), page_num,
+                                                      image.media_type)
+            scores.append(_recall(reference, page_data))
+        print(f"{page_num:>5} {len(reference):>8} {scores[0]:>9.1%} {scores[1]:>10.1%}  {describe(image)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report (or check) the payload savings of optimized page images")
+    parser.add_argument("--pdf", default="tarfah.pdf", help="Path to the PDF file")
+    parser.add_argument("--start", type=int, default=1, help="First page")
+    parser.add_argument("--end", type=int, help="Last page (default: --start)")
+    parser.add_argument("--dpi", type=int, default=200, help="Render resolution (default: 200)")
+    parser.add_argument("--mode", choices=MODES, default="gray", help="Colour reduction (default: gray)")
+    parser.add_argument("--output", help="Also write the optimized images to this directory")
+    parser.add_argument("--evaluate", action="store_true",
+                        help="Compare vision extraction accuracy on original and optimized images (uses the API)")
+    args = parser.parse_args()
+
+    pages = range(args.start, (args.end or args.start) + 1)
+    if args.evaluate:
+        evaluate(args.pdf, pages, args.dpi, args.mode)
+        return
+
+    from page_renderer import PageRenderer
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    original_total = optimized_total = 0
+    with PageRenderer(args.pdf, args.dpi) as renderer:
+        for page_num, png in renderer.iter_pages(pages.start, pages.stop - 1):
+            image = optimize_page(png, args.dpi, args.mode)
+            original_total += image.original_size
+            optimized_total += len(image.data)
+            print(f"Page {page_num}: {describe(image)}")
+            if args.output:
+                with open(os.path.join(args.output, f"page_{page_num}.{extension(image)}"), "wb") as f:
+                    f.write(image.data)
+    if original_total:
+        print(f"Total: {original_total / 1e6:.1f} MB -> {optimized_total / 1e6:.1f} MB "
+              f"({1 - optimized_total / original_total:.0%} smaller)")
+
+
+if __name__ == "__main__":
+    main()
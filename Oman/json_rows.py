@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Recover table rows from vision model responses that were cut off at max_tokens.
+
+A truncated response is not valid JSON, but every row object that was closed
+before the cut is intact. complete_rows scans for the rows array and returns
+those objects, so a continuation request only has to ask for the rows after
+the last one received. RowParser does the same incrementally on a streamed
+response, so rows reach the writer (RowStream) as soon as they are complete.
+"""
+
+import re
+import json
+import time
+
+TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+
+def _array_start(text, key=None):
+    """Index just past the '[' that opens the rows array (the first one after "key", if given)."""
+    start = 0
+    if key:
+        start = text.find(f'"{key}"')
+        if start == -1:
+            return -1
+    start = text.find('[', start)
+    return -1 if start == -1 else start + 1
+
+
+def parse_row(text):
+    """Parse one row object, tolerating trailing commas; None if it is malformed."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(TRAILING_COMMA.sub(r'\1', text))
+    except json.JSONDecodeError:
+        return None
+
+
+class RowParser:
+    """
+    Incremental parser for the rows array of a streamed response.
+
+    feed() takes the response text as it arrives and returns the rows completed
+    by that chunk. Each row is parsed on its own, so a malformed row is skipped
+    (and counted) without losing the rows around it, and an unfinished row at
+    the end of a truncated response is simply never returned.
+    """
+
+    def __init__(self, key=None):
+        self.key = key
+        self.text = ""
+        self.rows = []
+        self.malformed = 0
+        # Scan state, kept between chunks
+        self._position = -1
+        self._depth = 0
+        self._row_start = None
+        self._in_string = False
+        self._escaped = False
+        self._done = False
+
+    def feed(self, text):
+        """Add the next chunk of response text and return the rows it completed."""
+        self.text += text
+        if self._done:
+            return []
+        if self._position == -1:
+            self._position = _array_start(self.text, self.key)
+            if self._position == -1:
+                return []
+
+        new_rows = []
+        text = self.text
+        index = self._position
+        while index < len(text):
+            char = text[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                if self._depth == 0 and char == '{':
+                    self._row_start = index
+                self._depth += 1
+            elif char in '}]':
+                if self._depth == 0:
+                    # End of the rows array
+                    self._done = True
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._row_start is not None:
+                    row = parse_row(text[self._row_start:index + 1])
+                    if row is None:
+                        self.malformed += 1
+                    else:
+                        new_rows.append(row)
+                    self._row_start = None
+            index += 1
+        self._position = index
+        self.rows.extend(new_rows)
+        return new_rows
+
+
+def complete_rows(text, key=None):
+    """
+    Return the complete objects of the rows array in a (possibly truncated) JSON text.
+
+    Args:
+        text: Response text, optionally wrapped in a ```json code block
+        key: Name of the array in the top-level object (e.g. 'entries'), or None
+             when the response is the array itself
+    """
+    parser = RowParser(key)
+    parser.feed(text)
+    return parser.rows
+
+
+class RowStream:
+    """
+    Rows of a streamed response, appended to a JSON Lines file as each one completes.
+
+    Downstream readers can tail the file while the page is still being generated.
+    """
+
+    def __init__(self, path, key=None):
+        self.path = path
+        self.key = key
+        self.parser = RowParser(key)
+        self.added = []
+        self.first_row_at = None
+        self._started = time.time()
+        open(path, "w", encoding="utf-8").close()
+
+    @property
+    def rows(self):
+        return self.parser.rows + self.added
+
+    @property
+    def malformed(self):
+        return self.parser.malformed
+
+    def _write(self, rows):
+        if not rows:
+            return
+        if self.first_row_at is None:
+            self.first_row_at = time.time() - self._started
+        with open(self.path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def feed(self, text):
+        """Parse the next chunk of the response and write the rows it completed."""
+        rows = self.parser.feed(text)
+        self._write(rows)
+        return rows
+
+    def add(self, rows):
+        """Write rows obtained outside the stream (e.g. from a continuation request)."""
+        self.added.extend(rows)
+        self._write(rows)
+
+    def restart(self):
+        """Discard everything streamed so far, for a retried request."""
+        self.parser = RowParser(self.key)
+        self.added = []
+        open(self.path, "w", encoding="utf-8").close()
+
+
+def last_value(rows, field):
+    """The last non-empty value of field in rows, or None."""
+    for row in reversed(rows):
+        if isinstance(row, dict) and row.get(field):
+            return row[field]
+    return None
+
+
+def rows_after(rows, field, value):
+    """Drop the leading rows up to and including the one whose field equals value (repeated by a continuation)."""
+    normalized = ''.join(str(value).split())
+    for index, row in enumerate(rows[:3]):
+        if isinstance(row, dict) and ''.join(str(row.get(field) or '').split()) == normalized:
+            return rows[index + 1:]
+    return rows
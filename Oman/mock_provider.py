@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Local HTTP stand-in for the OpenAI and Anthropic APIs, for offline load tests.
+
+Serves POST /v1/chat/completions and /v1/messages (also without the /v1
+prefix), streaming included, so extraction_backend.py --base-url can be run
+against it without credentials or cost. The backends never use the response
+cache with a custom endpoint, so mock answers are not stored under real keys.
+
+Each request is answered with a recorded page response from the response
+cache. When the cache holds the request's own key, a recorded run is replayed
+exactly. Otherwise the response is a recorded one for the same model, chosen
+deterministically from the request, or a synthetic page when nothing is
+recorded. Before answering, the server waits --latency seconds (+/- --jitter).
+It fails a --error-rate share of requests with 500 and a --throttle-rate share
+with 429 and a Retry-After header. With --rpm it also enforces a real
+requests/minute quota, answering 429 once that is exceeded.
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from response_cache import ResponseCache, request_key, DEFAULT_CACHE_DIR
+
+DEFAULT_PORT = 8765
+SYNTHETIC_ROWS = 40
+# Rough token counts for the usage block
+PROMPT_TOKENS = 1500
+CHARS_PER_TOKEN = 4
+
+
+def synthetic_rows(count=SYNTHETIC_ROWS):
+    """Plausible OpenAI-style tariff entries for when no response is recorded."""
+    return [{"H.S. Code": f"01 {index // 10 + 1:02d} {index % 10}0 00", "Description in English": f"Item {index}",
+             "Description in Arabic": None, "Duty Rate": "5%", "SFTA": None, "SG": None, "URA": None}
+            for index in range(count)]
+
+
+def _anthropic_rows(entries):
+    keys = {"H.S. Code": "HS_CODE", "Description in English": "DESCRIPTION", "Duty Rate": "DUTY_RATE",
+            "SFTA": "EFTA", "SG": "SG", "URA": "USA"}
+    return [{new: entry.get(old) or "" for old, new in keys.items()} for entry in entries]
+
+
+class Recordings:
+    """Recorded responses from a response cache directory, by key and by model."""
+
+    def __init__(self, cache_dir):
+        self.cache = ResponseCache(cache_dir, max_age_days=float("inf"), mode="on")
+        self.by_model = {}
+        for _, record in self.cache._records():
+            self.by_model.setdefault(record.get("model"), []).append(
+                (record["content"], bool(record.get("truncated"))))
+
+    def lookup(self, key, model):
+        """(content, truncated, replayed) for a request."""
+        cached = self.cache.get_response(key)
+        if cached is not None:
+            return cached[0], cached[1], True
+        recorded = self.by_model.get(model)
+        if recorded:
+            content, truncated = recorded[int(key, 16) % len(recorded)]
+            return content, truncated, False
+        return None, False, False
+
+
+class MockState:
+    def __init__(self, recordings, latency, jitter, error_rate, throttle_rate, retry_after, rpm, seed):
+        self.recordings = recordings
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rpm = rpm
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.counts = {"requests": 0, "replayed": 0, "recorded": 0, "synthetic": 0, "throttled": 0, "errors": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def admit(self):
+        """None to serve the request, or (status, retry_after) to fail it."""
+        with self.lock:
+            self.counts["requests"] += 1
+            now = time.monotonic()
+            if self.rpm:
+                while self.recent and now - self.recent[0] >= 60:
+                    self.recent.popleft()
+                if len(self.recent) >= self.rpm:
+                    return 429, max(1, int(60 - (now - self.recent[0]) + 1))
+                self.recent.append(now)
+            draw = self.random.random()
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        if draw < self.throttle_rate:
+            return 429, self.retry_after
+        if draw < self.throttle_rate + self.error_rate:
+            time.sleep(delay)
+            return 500, None
+        time.sleep(delay)
+        return None
+
+
+def _openai_request(body):
+    """Response cache key of a chat completions request, computed as the extraction scripts do."""
+    system, prompt, image = None, "", b""
+    for message in body.get("messages", []):
+        if message.get("role") == "system":
+            system = message.get("content")
+        elif isinstance(message.get("content"), list):
+            for part in message["content"]:
+                if part.get("type") == "text":
+                    prompt = part["text"]
+                elif part.get("type") == "image_url":
+                    image = part["image_url"]["url"].split(",", 1)[-1]
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        system = [system, response_format["json_schema"]["schema"]]
+    return request_key(image or b"", system, prompt, body.get("model"), body.get("max_tokens"))
+
+
+def _anthropic_request(body):
+    """Response cache key of a messages request, computed as anthropic/process_tarfah.py does."""
+    prompt, image = "", b""
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            prompt = content
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                prompt = part["text"]
+            elif part.get("type") == "image":
+                image = part["source"]["data"]
+    tools = body.get("tools") or []
+    return request_key(image or b"", tools[0] if tools else None, prompt, body.get("model"), body.get("max_tokens"))
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+    verbose = False
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_events(self, events):
+        """Send (event name or None, payload) pairs as server-sent events."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for event, payload in events:
+            data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+            line = (f"event: {event}\n" if event else "") + f"data: {data}\n\n"
+            self.wfile.write(line.encode("utf-8"))
+            self.wfile.flush()
+
+    def _send_error(self, anthropic, status, retry_after):
+        kind = "rate_limit_error" if status == 429 else "api_error"
+        message = "Mock rate limit exceeded" if status == 429 else "Mock server error"
+        if anthropic:
+            payload = {"type": "error", "error": {"type": kind, "message": message}}
+        else:
+            payload = {"error": {"message": message, "type": kind, "param": None, "code": kind}}
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else None
+        if status == 429:
+            self.state.count("throttled")
+        else:
+            self.state.count("errors")
+        self._send_json(status, payload, headers)
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            anthropic = False
+        elif path.endswith("/messages"):
+            anthropic = True
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+
+        failure = self.state.admit()
+        if failure:
+            self._send_error(anthropic, *failure)
+            return
+
+        key = _anthropic_request(body) if anthropic else _openai_request(body)
+        content, truncated, replayed = self.state.recordings.lookup(key, body.get("model"))
+        if content is None:
+            self.state.count("synthetic")
+            entries = synthetic_rows()
+            if anthropic:
+                content = json.dumps({"rows": _anthropic_rows(entries)} if body.get("tools")
+                                     else _anthropic_rows(entries))
+            else:
+                content = json.dumps({"entries": entries, "metadata": []})
+        else:
+            self.state.count("replayed" if replayed else "recorded")
+
+        if anthropic:
+            self._anthropic_response(body, key, content, truncated)
+        else:
+            self._openai_response(body, key, content, truncated)
+
+    def _openai_response(self, body, key, content, truncated):
+        finish_reason = "length" if truncated else "stop"
+        completion_tokens = len(content) // CHARS_PER_TOKEN
+        usage = {"prompt_tokens": PROMPT_TOKENS, "completion_tokens": completion_tokens,
+                 "total_tokens": PROMPT_TOKENS + completion_tokens}
+        base = {"id": f"chatcmpl-mock-{key[:12]}", "created": int(time.time()), "model": body.get("model")}
+        if not body.get("stream"):
+            self._send_json(200, {**base, "object": "chat.completion", "usage": usage, "choices": [{
+                "index": 0, "logprobs": None, "finish_reason": finish_reason,
+                "message": {"role": "assistant", "content": content, "refusal": None}}]})
+            return
+
+        def chunk(delta, finish=None):
+            return None, {**base, "object": "chat.completion.chunk", "choices": [
+                {"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish}]}
+
+        events = [chunk({"role": "assistant", "content": ""})]
+        events += [chunk({"content": content[start:start + 64]}) for start in range(0, len(content), 64)]
+        events.append(chunk({}, finish_reason))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            events.append((None, {**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}))
+        events.append((None, "[DONE]"))
+        self._send_events(events)
+
+    def _anthropic_response(self, body, key, content, truncated):
+        tools = body.get("tools") or []
+        if tools:
+            try:
+                tool_input = json.loads(content)
+            except json.JSONDecodeError:
+                # Truncated tool input: only the streamed JSON carries it
+                tool_input = None
+            if isinstance(tool_input, list):
+                tool_input = {"rows": tool_input}
+            block = {"type": "tool_use", "id": f"toolu_mock_{key[:12]}", "name": tools[0]["name"],
+                     "input": tool_input or {}}
+            text = content if tool_input is None else json.dumps(tool_input, ensure_ascii=False)
+            stop_reason = "max_tokens" if truncated else "tool_use"
+        else:
+            block = {"type": "text", "text": content}
+            text = content
+            stop_reason = "max_tokens" if truncated else "end_turn"
+        usage = {"input_tokens": PROMPT_TOKENS, "output_tokens": len(text) // CHARS_PER_TOKEN}
+        message = {"id": f"msg_mock_{key[:12]}", "type": "message", "role": "assistant", "model": body.get("model"),
+                   "stop_reason": stop_reason, "stop_sequence": None}
+        if not body.get("stream"):
+            self._send_json(200, {**message, "content": [block], "usage": usage})
+            return
+
+        if tools:
+            start_block = {**block, "input": {}}
+            deltas = [{"type": "input_json_delta", "partial_json": text[start:start + 64]}
+                      for start in range(0, len(text), 64)]
+        else:
+            start_block = {"type": "text", "text": ""}
+            deltas = [{"type": "text_delta", "text": text[start:start + 64]} for start in range(0, len(text), 64)]
+        events = [("message_start", {"type": "message_start", "message": {
+                      **message, "content": [], "stop_reason": None, "usage": {**usage, "output_tokens": 1}}}),
+                  ("content_block_start", {"type": "content_block_start", "index": 0, "content_block": start_block})]
+        events += [("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": delta})
+                   for delta in deltas]
+        events += [("content_block_stop", {"type": "content_block_stop", "index": 0}),
+                   ("message_delta", {"type": "message_delta",
+                                      "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                                      "usage": {"output_tokens": usage["output_tokens"]}}),
+                   ("message_stop", {"type": "message_stop"})]
+        self._send_events(events)
+
+
+def serve(port=DEFAULT_PORT, host="127.0.0.1", cache_dir=DEFAULT_CACHE_DIR, latency=1.0, jitter=0.0,
+          error_rate=0.0, throttle_rate=0.0, retry_after=1, rpm=0, seed=None, verbose=False):
+    """Create the mock server (call serve_forever() on it); its MockState is server.state."""
+    state = MockState(Recordings(cache_dir), latency, jitter, error_rate, throttle_rate, retry_after, rpm, seed)
+    handler = type("Handler", (MockHandler,), {"state": state, "verbose": verbose})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI/Anthropic API that replays recorded page responses")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Response cache with the recorded responses")
+    parser.add_argument("--latency", type=float, default=1.0, help="Seconds before each response (default: 1.0)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with random 429s")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before answering 429 (0: no limit)")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible failures")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.host, args.cache_dir, args.latency, args.jitter, args.error_rate,
+                   args.throttle_rate, args.retry_after, args.rpm, args.seed, args.verbose)
+    recorded = sum(len(responses) for responses in server.state.recordings.by_model.values())
+    print(f"Mock provider on http://{args.host}:{args.port} ({recorded} recorded responses)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(", ".join(f"{count} {name}" for name, count in server.state.counts.items()))
+
+
+if __name__ == "__main__":
+    main()
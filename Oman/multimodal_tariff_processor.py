@@ -13,18 +13,28 @@ import json
 import base64
 import time
 import argparse
-import re
+import asyncio
+import concurrent.futures
 from pathlib import Path
 
-import openai
-from pdf2image import convert_from_path
 from PIL import Image
 
+from vision_pipeline import RateLimiter, run_pipeline, add_rate_limit_arguments
+from page_renderer import PageRenderer, ImageSaver, render_page, count_pages, DEFAULT_DPI
+from image_optimizer import prepare_page_image, describe, extension
+from page_tiles import split_page, merge_tile_entries, entry_key
+from response_cache import ResponseCache
+from extraction_backend import OpenAIBackend
+from api_clients import pool_size_for
+from json_rows import RowStream
+
 # Constants
 PDF_PATH = "tarfah.pdf"
 OUTPUT_DIR = "tarfah_page_images"
 RESULTS_DIR = "processed_pages"
 FINAL_OUTPUT = "oman_tariff_data_multimodal.json"
+MAX_TOKENS = 4096
+MODEL = "gpt-4o"
 
 # Create output directories if they don't exist
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -38,156 +48,131 @@ except ImportError:
     if not OPENAI_API_KEY:
         raise ValueError("OpenAI API key not found. Either set OPENAI_API_KEY environment variable or create an openai_api_key.py file.")
 
-# Set up OpenAI API key
-openai.api_key = OPENAI_API_KEY
 
-def encode_image_to_base64(image_path: str) -> str:
-    """Convert an image file to base64 string."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+RESPONSE_CACHE = ResponseCache()
+# Requests, retries, the response cache and continuation of truncated responses
+# (--structured sets BACKEND.structured to constrain responses to extraction_schema.PAGE_SCHEMA)
+BACKEND = OpenAIBackend(model=MODEL, max_tokens=MAX_TOKENS, api_key=OPENAI_API_KEY, cache=RESPONSE_CACHE)
 
-def save_image(image, page_num):
-    """Save an image to disk."""
-    image_path = os.path.join(OUTPUT_DIR, f"page_{page_num}.png")
-    image.save(image_path)
-    return image_path
+def encode_image_to_base64(data: bytes) -> str:
+    """Convert image bytes to a base64 string."""
+    return base64.b64encode(data).decode('utf-8')
 
-def extract_table_data_from_image(image_base64: str, page_num: int):
-    """Extract table data from an image using OpenAI's vision model."""
-    MAX_RETRIES = 3
-    RETRY_DELAY = 2  # seconds
-    
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = openai.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """
-                        You are a data extraction specialist focusing on Oman's Customs Tariff tables. Your task is to extract ALL columns from the tables with high precision.
-
-                        For each entry in the table, extract these exact fields:
-                        - H.S. Code: The tariff code in the rightmost column (e.g., "01.01", "01 01 21 00 10", "25.03")
-                        - Description in English: The column with English product descriptions
-                        - Description in Arabic: The column with Arabic product descriptions
-                        - Duty Rate: The percentage value (e.g., "0%", "5%", "PROHIBITED") - this should ALWAYS go in the Duty Rate field
-                        - SFTA: The leftmost indicator column, usually contains A, B, C, etc.
-                        - SG: The second indicator column from left
-                        - URA: The third indicator column from left (before the duty rate)
-                        
-                        IMPORTANT RULES:
-                        1. Duty Rate should NEVER be placed in the SFTA, SG or URA fields
-                        2. The indicator columns (SFTA, SG, URA) should contain only single character values like "A", "B", "+", "-" etc.
-                        3. Don't mix up numerical percentages (0%, 5%) with letter indicators (A, B, C)
-                        4. Be careful about right-to-left text in the Arabic column
-                        5. If a field is empty, use null, not an empty string
-                        6. Include ALL lines from the table, including headings and subheadings
-                        
-                        If a page has section headers, chapter headings, or notes, include those in a separate "metadata" section.
-                        
-                        Return the data in a structured JSON format with all the fields. Do not include any explanatory text, only the JSON.
-                        If a page doesn't contain tariff table data, return an empty entries array with a message.
-                        """
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": f"Extract ALL columns of tariff data from page {page_num} of Oman's Customs Tariff document. Return the results as a JSON object with an 'entries' array. Each entry should include the H.S. Code, English description, Arabic description, duty rate, and the SFTA, SG, and URA indicators."
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{image_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=4096
-            )
-            
-            # Extract content from API response
-            content = response.choices[0].message.content
-            
-            # Parse JSON content
-            try:
-                # First, try to extract JSON from code blocks
-                code_block_pattern = r"```(?:json)?\s*([\s\S]*?)\s*```"
-                code_blocks = re.findall(code_block_pattern, content)
-                
-                if code_blocks:
-                    for block in code_blocks:
-                        try:
-                            return json.loads(block.strip())
-                        except json.JSONDecodeError:
-                            continue
-                
-                # Try to find and parse JSON directly
-                json_start = content.find('{')
-                json_end = content.rfind('}')
-                
-                if json_start != -1 and json_end != -1:
-                    json_str = content[json_start:json_end + 1]
-                    try:
-                        return json.loads(json_str)
-                    except json.JSONDecodeError:
-                        # If the JSON is not valid, try to clean it up
-                        cleaned_json = re.sub(r'```json|```', '', json_str).strip()
-                        try:
-                            return json.loads(cleaned_json)
-                        except json.JSONDecodeError:
-                            pass
-                
-                # If all parsing attempts fail, return raw content
-                print(f"Content snippet: {content[:200]}...")
-                return {"raw_content": content, "parsing_error": "Failed to parse JSON from the response"}
-                
-            except Exception as e:
-                print(f"Error parsing response: {e}")
-                return {"raw_content": content, "parsing_error": f"Error parsing response: {str(e)}"}
-                
-        except Exception as e:
-            if attempt < MAX_RETRIES - 1:
-                print(f"Error: {e}. Retrying...")
-                time.sleep(RETRY_DELAY)
-            else:
-                print(f"Failed after {MAX_RETRIES} attempts: {e}")
-                return {"error": str(e)}
-
-def process_page(pdf_path: str, page_num: int) -> dict:
+def extract_table_data_from_image(image_base64: str, page_num: int, media_type: str = "image/png",
+                                  stream: RowStream = None):
+    """
+    Extract table data from an image using OpenAI's vision model.
+
+    Responses are kept in the response cache, so rerunning an unchanged page
+    re-parses the stored response instead of making a request. A response cut
+    off at max_tokens keeps its complete entries and continues from the last one.
+    With a stream, entries are parsed row by row as the response arrives, so a
+    malformed row costs that row instead of the page.
+    """
+    return asyncio.run(BACKEND.extract_page(image_base64, media_type, page_num, stream=stream))
+
+def row_stream(page_num: int, suffix: str = "", stream_rows: bool = True):
+    """RowStream writing a page's (or tile's) entries to RESULTS_DIR as they arrive, or None."""
+    if not stream_rows:
+        return None
+    return RowStream(os.path.join(RESULTS_DIR, f"page_{page_num}{suffix}_rows.jsonl"), "entries")
+
+def extract_text_layer_page(pdf_path: str, page_num: int):
+    """
+    Extract a page's table rows from the PDF text layer using glyph positions.
+
+    Returns page data in the same shape as extract_table_data_from_image, or None
+    when the page has no usable text layer (scanned page, no table, PyPDF2 missing).
+    """
+    try:
+        from tariff_pdf_layout import extract_page_entries, to_vision_entry
+        entries = extract_page_entries(pdf_path, page_num)
+    except Exception as e:
+        print(f"Text layer extraction failed for page {page_num}: {e}")
+        return None
+    if not entries:
+        return None
+    return {"entries": [to_vision_entry(entry) for entry in entries], "extraction": "text_layer"}
+
+def save_page_result(page_data: dict, page_num: int) -> dict:
+    """Tag page data with its page number and save it to RESULTS_DIR."""
+    page_data["page_number"] = page_num
+    output_file = os.path.join(RESULTS_DIR, f"page_{page_num}_result.json")
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(page_data, f, ensure_ascii=False, indent=2)
+
+    print(f"Results saved to {output_file}")
+    return page_data
+
+def merge_tile_results(tile_results: list) -> dict:
+    """Combine the page data extracted from a page's tiles into one page result."""
+    tile_results = [{"entries": result} if isinstance(result, list) else result for result in tile_results]
+    page_data = {
+        "entries": merge_tile_entries([result.get("entries") or [] for result in tile_results],
+                                      lambda entry: entry_key(entry, "H.S. Code", "Description in English")),
+        "tiles": len(tile_results),
+    }
+    metadata = []
+    for result in tile_results:
+        for meta in result.get("metadata") or []:
+            if meta not in metadata:
+                metadata.append(meta)
+    if metadata:
+        page_data["metadata"] = metadata
+    failed = [{"tile": index, **{key: result[key] for key in ("error", "parsing_error") if key in result}}
+              for index, result in enumerate(tile_results, 1) if "entries" not in result]
+    if failed:
+        page_data["failed_tiles"] = failed
+    return page_data
+
+def prepare_request_image(png: bytes, dpi: int, page_num: int, suffix: str, optimize_images: bool,
+                          image_saver: ImageSaver = None):
+    """Shrink a rendered page (or tile), queue it for saving and return (base64, media type)."""
+    image = prepare_page_image(png, dpi, optimize_images)
+    print(f"Page {page_num}{suffix.replace('_', ' ')} image: {describe(image)}")
+    if image_saver:
+        image_saver.save(page_num, image.data, extension(image), suffix)
+    return encode_image_to_base64(image.data), image.media_type
+
+def page_images(png: bytes, dpi: int, tile_pages: bool) -> list:
+    """(file suffix, PNG) of the images to send for a page: the page itself, or its row tiles."""
+    tiles = split_page(png, dpi) if tile_pages else [png]
+    if len(tiles) == 1:
+        return [("", tiles[0])]
+    return [(f"_tile_{index}", tile) for index, tile in enumerate(tiles, 1)]
+
+def process_page(pdf_path: str, page_num: int, use_text_layer: bool = True, optimize_images: bool = True,
+                 save_images: bool = True, tile_pages: bool = False, stream_rows: bool = False) -> dict:
     """Process a single page of the PDF."""
     print(f"Processing page {page_num} of {pdf_path}...")
     
     try:
-        # Convert PDF page to image
-        images = convert_from_path(pdf_path, first_page=page_num, last_page=page_num)
-        if not images:
-            print(f"Error: No image generated for page {page_num}")
-            return {"error": "No image generated"}
-        
-        # Save the image
-        image_path = save_image(images[0], page_num)
-        print(f"Image saved to {image_path}")
-        
-        # Convert image to base64
-        image_base64 = encode_image_to_base64(image_path)
-        
-        # Extract data
-        page_data = extract_table_data_from_image(image_base64, page_num)
-        
-        # Add page number to the data
-        page_data["page_number"] = page_num
+        # Text-based pages are read locally; only scanned pages go to the vision model
+        if use_text_layer:
+            page_data = extract_text_layer_page(pdf_path, page_num)
+            if page_data:
+                print(f"Extracted {len(page_data['entries'])} entries from the text layer")
+                return save_page_result(page_data, page_num)
+
+        # Render the PDF page (split into row tiles when tiling) and shrink it for the request
+        images = page_images(render_page(pdf_path, page_num), DEFAULT_DPI, tile_pages)
         
-        # Save the result to a JSON file
-        output_file = os.path.join(RESULTS_DIR, f"page_{page_num}_result.json")
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(page_data, f, ensure_ascii=False, indent=2)
+        # Images are saved in the background while the requests run from the in-memory copies;
+        # the tiles of a page are extracted concurrently
+        with ImageSaver(OUTPUT_DIR, save_images) as image_saver, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=len(images)) as executor:
+            def extract(suffix_png):
+                suffix, png = suffix_png
+                image_base64, media_type = prepare_request_image(png, DEFAULT_DPI, page_num, suffix,
+                                                                 optimize_images, image_saver)
+                return extract_table_data_from_image(image_base64, page_num, media_type,
+                                                     row_stream(page_num, suffix, stream_rows))
+
+            results = list(executor.map(extract, images))
+        page_data = results[0] if len(results) == 1 else merge_tile_results(results)
         
-        print(f"Results saved to {output_file}")
-        return page_data
+        # Add page number to the data and save it
+        return save_page_result(page_data, page_num)
     
     except Exception as e:
         print(f"Error processing page {page_num}: {e}")
@@ -202,10 +187,8 @@ def count_pdf_pages(pdf_path: str) -> int:
             return len(pdf.pages)
     except Exception as e:
         print(f"Error counting PDF pages: {e}")
-        # Fallback method using pdf2image
-        from pdf2image import convert_from_path
-        images = convert_from_path(pdf_path, dpi=72, first_page=1, last_page=None)
-        return len(images)
+        # Fallback without rendering any page
+        return count_pages(pdf_path)
 
 def merge_results(results_dir: str, output_file: str):
     """Merge all page results into a single JSON file."""
@@ -255,12 +238,57 @@ def merge_results(results_dir: str, output_file: str):
     print(f"Merged data saved to {output_file}")
     return all_data
 
-def process_range(pdf_path: str, start_page: int, end_page: int):
-    """Process a range of pages from the PDF."""
-    for page_num in range(start_page, end_page + 1):
-        process_page(pdf_path, page_num)
-        # Add a delay to avoid rate limiting
-        time.sleep(1)
+async def process_page_async(pdf_path: str, page_num: int, limiter: RateLimiter, renderer: PageRenderer,
+                             use_text_layer: bool = True, optimize_images: bool = True,
+                             image_saver: ImageSaver = None, tile_pages: bool = False,
+                             stream_rows: bool = False) -> dict:
+    """Process a single page, waiting on the shared rate limiter only for the API requests."""
+    print(f"Processing page {page_num} of {pdf_path}...")
+
+    try:
+        if use_text_layer:
+            page_data = await asyncio.to_thread(extract_text_layer_page, pdf_path, page_num)
+            if page_data:
+                print(f"Extracted {len(page_data['entries'])} entries from the text layer of page {page_num}")
+                return save_page_result(page_data, page_num)
+
+        png = await renderer.render_async(page_num)
+        images = await asyncio.to_thread(page_images, png, renderer.dpi, tile_pages)
+
+        async def extract(suffix, image_png):
+            image_base64, media_type = await asyncio.to_thread(prepare_request_image, image_png, renderer.dpi,
+                                                               page_num, suffix, optimize_images, image_saver)
+            # Every request of the page, retries and continuations included, waits on the limiter
+            return await BACKEND.extract_page(image_base64, media_type, page_num, limiter,
+                                              row_stream(page_num, suffix, stream_rows))
+
+        # The tiles of a page run concurrently, each paced by the rate limiter
+        results = await asyncio.gather(*(extract(suffix, image_png) for suffix, image_png in images))
+        page_data = results[0] if len(results) == 1 else merge_tile_results(results)
+        return save_page_result(page_data, page_num)
+
+    except Exception as e:
+        print(f"Error processing page {page_num}: {e}")
+        return {"error": str(e)}
+
+def process_range(pdf_path: str, start_page: int, end_page: int, use_text_layer: bool = True,
+                  limiter: RateLimiter = None, concurrency: int = 8, optimize_images: bool = True,
+                  save_images: bool = True, tile_pages: bool = False, stream_rows: bool = False):
+    """Process a range of pages concurrently, paced by the requests/tokens per minute quota."""
+    limiter = limiter or RateLimiter()
+
+    start = time.time()
+    # The renderer keeps the PDF open in its workers; the pipeline bounds how many
+    # rendered pages are held at once. Page images are written to disk in the background.
+    with PageRenderer(pdf_path) as renderer, ImageSaver(OUTPUT_DIR, save_images) as image_saver:
+        async def process(page_num):
+            return await process_page_async(pdf_path, page_num, limiter, renderer, use_text_layer,
+                                            optimize_images, image_saver, tile_pages, stream_rows)
+
+        results = asyncio.run(run_pipeline(range(start_page, end_page + 1), process, concurrency))
+    print(f"Processed {len(results)} pages in {time.time() - start:.1f}s "
+          f"({limiter.waited:.1f}s waiting on the rate limit, {RESPONSE_CACHE.hits} cached responses)")
+    return results
 
 def main():
     """Main function."""
@@ -269,7 +297,22 @@ def main():
     parser.add_argument("--start", type=int, default=1, help="Starting page number")
     parser.add_argument("--end", type=int, help="Ending page number")
     parser.add_argument("--merge-only", action="store_true", help="Only merge existing results")
+    parser.add_argument("--vision-only", action="store_true", help="Send every page to the vision model, even text-based ones")
+    parser.add_argument("--full-images", action="store_true",
+                        help="Send pages as rendered (full-colour PNG) instead of optimized images")
+    parser.add_argument("--no-save-images", action="store_true", help=f"Don't keep page images in {OUTPUT_DIR}/")
+    parser.add_argument("--tile", action="store_true",
+                        help="Split dense pages into overlapping row tiles so responses fit in max_tokens")
+    parser.add_argument("--structured", action="store_true",
+                        help="Constrain responses to the JSON schema in extraction_schema.py (no JSON repair)")
+    parser.add_argument("--stream", action="store_true",
+                        help=f"Stream responses and write each page's entries to {RESULTS_DIR}/page_N_rows.jsonl as they arrive")
+    add_rate_limit_arguments(parser)
     args = parser.parse_args()
+
+    BACKEND.structured = args.structured
+    # A connection for each request run_pipeline can have in flight
+    BACKEND.pool_size = pool_size_for(args.concurrency)
     
     pdf_path = os.path.join(os.path.dirname(__file__), PDF_PATH)
     
@@ -286,9 +329,12 @@ def main():
     if args.merge_only:
         print("Skipping processing, merging existing results only")
     elif args.page:
-        process_page(pdf_path, args.page)
+        process_page(pdf_path, args.page, not args.vision_only, not args.full_images, not args.no_save_images,
+                     args.tile, args.stream)
     else:
-        process_range(pdf_path, args.start, args.end)
+        limiter = RateLimiter(args.rpm, args.tpm)
+        process_range(pdf_path, args.start, args.end, not args.vision_only, limiter, args.concurrency,
+                      not args.full_images, not args.no_save_images, args.tile, args.stream)
     
     # Merge results
     merge_results(RESULTS_DIR, FINAL_OUTPUT)
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+PDF page rendering for the vision scripts, with the document opened once per worker.
+
+convert_from_path(first_page=n, last_page=n) starts a pdftoppm process that
+re-opens and re-parses the whole PDF for every page, while converting the whole
+document in one call keeps every page image in memory. PageRenderer keeps a
+small pool of worker processes instead. Each worker holds the document open
+(pypdfium2 when installed; otherwise pdf2image renders a block of consecutive
+pages per pdftoppm call) and returns finished PNG bytes, so compression runs in
+parallel too. Pages are only rendered a bounded distance ahead of the consumer.
+
+Rendered pages are kept in a content-addressed cache (render_cache.py), so a
+rerun on an unchanged PDF with the same settings does not render at all, and
+the worker pool is only started on the first cache miss.
+"""
+
+import io
+import os
+import asyncio
+import argparse
+import collections
+import concurrent.futures
+
+from render_cache import RenderCache
+
+DEFAULT_DPI = 200  # pdf2image's default, which the scripts have always used
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+# Consecutive pages per pdftoppm call when falling back to pdf2image
+PDF2IMAGE_BLOCK = 8
+
+# Per-process state, set up by _open_document
+_pdf_path = None
+_document = None
+# Render cache of render_page, created on first use in each process
+_render_cache = None
+
+
+def _open_document(pdf_path):
+    global _pdf_path, _document
+    _pdf_path = pdf_path
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        _document = None
+        return
+    _document = pdfium.PdfDocument(pdf_path)
+
+
+def _finish(image, mode, crop):
+    """Apply the colour mode and crop box (fractions of the page: left, top, right, bottom)."""
+    if crop:
+        left, top, right, bottom = crop
+        width, height = image.size
+        image = image.crop((round(left * width), round(top * height), round(right * width), round(bottom * height)))
+    if image.mode != mode:
+        image = image.convert(mode)
+    return image
+
+
+def _to_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _render_block(first_page, last_page, dpi, mode="RGB", crop=None):
+    """Render pages first_page..last_page (1-based) of the open document to PNG bytes."""
+    if _document is None:
+        from pdf2image import convert_from_path
+        images = convert_from_path(_pdf_path, dpi=dpi, first_page=first_page, last_page=last_page)
+        return [_to_png(_finish(image, mode, crop)) for image in images]
+
+    pages = []
+    for page_num in range(first_page, last_page + 1):
+        page = _document[page_num - 1]
+        try:
+            pages.append(_to_png(_finish(page.render(scale=dpi / 72).to_pil(), mode, crop)))
+        finally:
+            page.close()
+    return pages
+
+
+def _has_pdfium():
+    try:
+        import pypdfium2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def count_pages(pdf_path):
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        from PyPDF2 import PdfReader
+        return len(PdfReader(pdf_path).pages)
+    document = pdfium.PdfDocument(pdf_path)
+    try:
+        return len(document)
+    finally:
+        document.close()
+
+
+def render_page(pdf_path, page_num, dpi=DEFAULT_DPI, mode="RGB", crop=None, use_cache=True):
+    """Render one page to PNG bytes in this process (for single-page scripts)."""
+    global _render_cache
+    cache = None
+    if use_cache:
+        if _render_cache is None:
+            _render_cache = RenderCache()
+        cache = _render_cache
+    if cache:
+        key = cache.key(cache.pdf_fingerprint(pdf_path), page_num, dpi, mode, crop)
+        png = cache.get(key)
+        if png is not None:
+            return png
+
+    if _pdf_path != pdf_path:
+        _open_document(pdf_path)
+    png = _render_block(page_num, page_num, dpi, mode, crop)[0]
+    if cache:
+        cache.put(key, png)
+    return png
+
+
+class PageRenderer:
+    """
+    Pool of rendering processes that each keep the PDF open, in front of the render cache.
+
+    Use as a context manager. With workers=0 pages are rendered in this process.
+    """
+
+    def __init__(self, pdf_path, dpi=DEFAULT_DPI, workers=DEFAULT_WORKERS, max_pending=None,
+                 mode="RGB", crop=None, use_cache=True):
+        self.pdf_path = pdf_path
+        self.dpi = dpi
+        self.mode = mode
+        self.crop = crop
+        self.workers = workers
+        # Rendered pages held ahead of the consumer by iter_pages
+        self.max_pending = max_pending or max(2, 2 * workers)
+        self.executor = None
+        self.rendered = 0
+        self.cache = RenderCache() if use_cache else None
+        self.fingerprint = self.cache.pdf_fingerprint(pdf_path) if self.cache else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def _key(self, page_num):
+        return self.cache.key(self.fingerprint, page_num, self.dpi, self.mode, self.crop)
+
+    def _cached(self, page_num):
+        return self.cache.get(self._key(page_num)) if self.cache else None
+
+    def _store(self, first_page, pages):
+        self.rendered += len(pages)
+        if self.cache:
+            for offset, png in enumerate(pages):
+                self.cache.put(self._key(first_page + offset), png)
+        return pages
+
+    def _submit_block(self, first_page, last_page):
+        if self.workers:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_open_document, initargs=(self.pdf_path,))
+            return self.executor.submit(_render_block, first_page, last_page, self.dpi, self.mode, self.crop)
+        future = concurrent.futures.Future()
+        try:
+            if _pdf_path != self.pdf_path:
+                _open_document(self.pdf_path)
+            future.set_result(_render_block(first_page, last_page, self.dpi, self.mode, self.crop))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def render(self, page_num):
+        """Render one page (or fetch it from the cache) and return its PNG bytes."""
+        png = self._cached(page_num)
+        if png is None:
+            png = self._store(page_num, self._submit_block(page_num, page_num).result())[0]
+        return png
+
+    async def render_async(self, page_num):
+        """Render one page in the pool without blocking the event loop."""
+        png = self._cached(page_num)
+        if png is None:
+            pages = await asyncio.wrap_future(self._submit_block(page_num, page_num))
+            png = self._store(page_num, pages)[0]
+        return png
+
+    def _blocks(self, first_page, last_page, block):
+        """Split the range into cached single pages and blocks of up to `block` pages to render."""
+        run = []
+        for page_num in range(first_page, last_page + 1):
+            if self.cache and self.cache.contains(self._key(page_num)):
+                if run:
+                    yield run[0], run[-1], False
+                    run = []
+                yield page_num, page_num, True
+                continue
+            run.append(page_num)
+            if len(run) == block:
+                yield run[0], run[-1], False
+                run = []
+        if run:
+            yield run[0], run[-1], False
+
+    def iter_pages(self, first_page, last_page):
+        """
+        Yield (page number, PNG bytes) in order, rendering ahead in the pool.
+
+        At most max_pending pages are rendered but not yet consumed.
+        """
+        block = 1 if _has_pdfium() else PDF2IMAGE_BLOCK
+        blocks = self._blocks(first_page, last_page, block)
+        pending = collections.deque()
+        max_blocks = max(1, self.max_pending // block)
+        while True:
+            while len(pending) < max_blocks:
+                start, end, cached = next(blocks, (None, None, None))
+                if start is None:
+                    break
+                pending.append((start, None if cached else self._submit_block(start, end)))
+            if not pending:
+                return
+            start, future = pending.popleft()
+            if future is None:
+                # Cached page (render it after all if it was evicted since)
+                yield start, self.render(start)
+                continue
+            for offset, png in enumerate(self._store(start, future.result())):
+                yield start + offset, png
+
+
+def _write_image(path, data):
+    try:
+        with open(path, "wb") as f:
+            f.write(data)
+    except OSError as e:
+        print(f"Could not save {path}: {e}")
+
+
+class ImageSaver:
+    """
+    Write page images to disk in a background thread, off the extraction path.
+
+    save() returns at once; leaving the with block (or close()) waits for the
+    pending writes. With enabled=False nothing is written.
+    """
+
+    def __init__(self, output_dir, enabled=True):
+        self.output_dir = output_dir
+        self.executor = None
+        if enabled:
+            os.makedirs(output_dir, exist_ok=True)
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def save(self, page_num, data, ext="png", suffix=""):
+        """Queue page_<page_num><suffix>.<ext> for writing; returns its path, or None when disabled."""
+        if not self.executor:
+            return None
+        path = os.path.join(self.output_dir, f"page_{page_num}{suffix}.{ext}")
+        self.executor.submit(_write_image, path, data)
+        return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render PDF pages to PNG files with a worker pool")
+    parser.add_argument("--pdf", default="tarfah.pdf", help="Path to the PDF file")
+    parser.add_argument("--output", default="tarfah_page_images", help="Output directory")
+    parser.add_argument("--start", type=int, default=1, help="First page to render")
+    parser.add_argument("--end", type=int, help="Last page to render (default: last page)")
+    parser.add_argument("--dpi", type=int, default=DEFAULT_DPI, help=f"Resolution (default: {DEFAULT_DPI})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Rendering processes")
+    parser.add_argument("--no-cache", action="store_true", help="Always render, bypassing the render cache")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    end = args.end or count_pages(args.pdf)
+    with PageRenderer(args.pdf, args.dpi, args.workers, use_cache=not args.no_cache) as renderer:
+        for page_num, png in renderer.iter_pages(args.start, end):
+            with open(os.path.join(args.output, f"page_{page_num}.png"), "wb") as f:
+                f.write(png)
+            print(f"Rendered page {page_num}/{end}")
+        if renderer.cache:
+            print(f"{renderer.cache.hits} pages from the render cache, {renderer.rendered} rendered")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Split dense pages into overlapping horizontal tiles for the vision model.
+
+A full tariff page can hold more rows than fit in max_tokens of JSON, and a
+truncated response loses the whole page. split_page finds the text rows on the
+rendered page (the row-ink projection from image_optimizer) and cuts it in the
+gaps between rows into tiles of at most ROWS_PER_TILE rows. Consecutive tiles
+share OVERLAP_ROWS rows so no row is cut in half, and every tile after the
+first gets the page's top HEADER_ROWS rows (title and column headers) pasted
+above it so the model still knows which column is which. The tiles are
+extracted concurrently and merge_tile_entries drops the rows extracted twice.
+"""
+
+import io
+import os
+import argparse
+
+from PIL import Image
+
+from image_optimizer import text_rows
+
+# Text rows per tile; pages with fewer rows are sent whole
+ROWS_PER_TILE = 30
+# Rows repeated at the top of the next tile
+OVERLAP_ROWS = 2
+# Rows at the top of the page (title, column headers) repeated above every later tile
+HEADER_ROWS = 3
+
+
+def _to_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _gap(rows, index, height):
+    """Pixel row halfway between text row index - 1 and text row index (page edges at the ends)."""
+    if index <= 0:
+        return 0
+    if index >= len(rows):
+        return height
+    return (rows[index - 1][1] + rows[index][0]) // 2
+
+
+def tile_bands(rows, height, rows_per_tile=ROWS_PER_TILE, overlap_rows=OVERLAP_ROWS):
+    """
+    (top, bottom) pixel bands of the tiles for a page with these text rows.
+
+    Each band starts and ends in the gap between two text rows.
+    """
+    if len(rows) <= rows_per_tile:
+        return [(0, height)]
+    step = max(1, rows_per_tile - overlap_rows)
+    bands = []
+    first = 0
+    while True:
+        last = min(first + rows_per_tile, len(rows))
+        bands.append((_gap(rows, first, height), _gap(rows, last, height)))
+        if last == len(rows):
+            return bands
+        first += step
+
+
+def split_page(png, dpi, rows_per_tile=ROWS_PER_TILE, overlap_rows=OVERLAP_ROWS, header_rows=HEADER_ROWS):
+    """
+    Split a rendered page into PNG tiles, top to bottom.
+
+    Returns [png] unchanged when the page has no more than rows_per_tile text rows.
+    """
+    page = Image.open(io.BytesIO(png))
+    rows = text_rows(page.convert("L"), dpi)
+    bands = tile_bands(rows, page.height, rows_per_tile, overlap_rows)
+    if len(bands) == 1:
+        return [png]
+
+    header = None
+    if header_rows:
+        header = page.crop((0, 0, page.width, _gap(rows, header_rows, page.height)))
+
+    tiles = []
+    for index, (top, bottom) in enumerate(bands):
+        tile = page.crop((0, top, page.width, bottom))
+        if index and header is not None and top >= header.height:
+            stacked = Image.new(page.mode, (page.width, header.height + tile.height), "white")
+            stacked.paste(header, (0, 0))
+            stacked.paste(tile, (0, header.height))
+            tile = stacked
+        tiles.append(_to_png(tile))
+    return tiles
+
+
+def entry_key(entry, code_field, description_field):
+    """Identity of an extracted row: HS code digits plus the normalized description."""
+    code = "".join(ch for ch in str(entry.get(code_field) or "") if ch.isdigit())
+    description = " ".join(str(entry.get(description_field) or "").lower().split())
+    return code, description
+
+
+def merge_tile_entries(tile_entries, key, window=2 * (OVERLAP_ROWS + HEADER_ROWS), header_rows=HEADER_ROWS):
+    """
+    Concatenate the entries of consecutive tiles, dropping rows extracted twice.
+
+    Duplicates come from two places at the top of every tile after the first:
+    the header strip pasted from the top of the page, whose rows the first tile
+    already returned, and the rows shared with the end of the previous tile.
+    So only the first `window` entries of a tile are compared, against the
+    first `header_rows` entries of the first tile and the last `window`
+    entries kept so far; identical rows further apart are kept.
+
+    Args:
+        tile_entries: Entry lists of the tiles, top to bottom
+        key: Function returning an entry's identity (e.g. entry_key with the field names)
+    """
+    merged = []
+    header = set()
+    for tile, entries in enumerate(tile_entries):
+        recent = header | {key(entry) for entry in merged[-window:]}
+        for index, entry in enumerate(entries):
+            if tile and index < window and key(entry) in recent:
+                continue
+            merged.append(entry)
+        if not tile:
+            header = {key(entry) for entry in entries[:header_rows]}
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split PDF pages into overlapping row tiles")
+    parser.add_argument("--pdf", default="tarfah.pdf", help="Path to the PDF file")
+    parser.add_argument("--page", type=int, required=True, help="Page to split")
+    parser.add_argument("--rows", type=int, default=ROWS_PER_TILE, help=f"Text rows per tile (default: {ROWS_PER_TILE})")
+    parser.add_argument("--output", default="tarfah_page_images", help="Directory for the tile images")
+    args = parser.parse_args()
+
+    from page_renderer import render_page, DEFAULT_DPI
+
+    os.makedirs(args.output, exist_ok=True)
+    tiles = split_page(render_page(args.pdf, args.page), DEFAULT_DPI, args.rows)
+    for index, tile in enumerate(tiles, 1):
+        path = os.path.join(args.output, f"page_{args.page}_tile_{index}.png")
+        with open(path, "wb") as f:
+            f.write(tile)
+        print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
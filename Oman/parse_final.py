@@ -1,6 +1,7 @@
 import re
-import pandas as pd
-import json
+from itertools import chain, islice
+
+from tariff_parser import write_entries
 
 class TariffParser:
     def __init__(self):
@@ -102,32 +103,33 @@ class TariffParser:
 
         return False
 
-    def parse_file(self, filename):
+    def iter_entries(self, filename):
+        """Yield each entry as soon as its HS code line has been parsed."""
         with open(filename, 'r', encoding='utf-8') as f:
-            current_section = []
-            
             for line in f:
                 self.parse_line(line)
-        
-        return self.data
+                if self.data:
+                    yield from self.data
+                    self.data.clear()
+
+    def parse_file(self, filename):
+        return list(self.iter_entries(filename))
 
 def save_data(data, base_filename):
-    # Save as JSON
     json_file = f"{base_filename}.json"
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-    
-    # Save as CSV
-    df = pd.DataFrame(data)
     csv_file = f"{base_filename}.csv"
-    df.to_csv(csv_file, index=False)
     
-    print(f"Processed {len(data)} entries")
+    # Keep only the first entries for the sample printout; the rest are streamed
+    data = iter(data)
+    head = list(islice(data, 50))
+    count = write_entries(chain(head, data), json_file, csv_file)
+    
+    print(f"Processed {count} entries")
     print(f"Output saved to {json_file} and {csv_file}")
     
     # Print sample entries
     print("\nSample entries:")
-    samples = [entry for entry in data[:50] if entry['description_en'] or entry['description_ar']]
+    samples = [entry for entry in head if entry['description_en'] or entry['description_ar']]
     for entry in samples[:3]:
         print("\nHS Code:", entry['hs_code'])
         print("Description (EN):", entry['description_en'][:100])
@@ -139,8 +141,7 @@ def save_data(data, base_filename):
 
 def main():
     parser = TariffParser()
-    data = parser.parse_file("tarfah.txt")
-    save_data(data, "oman_tariff_final3")
+    save_data(parser.iter_entries("tarfah.txt"), "oman_tariff_final3")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -8,9 +8,13 @@ import os
 import json
 import base64
 import argparse
+import asyncio
 from pathlib import Path
-import openai
-from pdf2image import convert_from_path
+
+from page_renderer import ImageSaver, render_page, DEFAULT_DPI
+from image_optimizer import optimize_page, describe, extension
+from response_cache import ResponseCache
+from extraction_backend import OpenAIBackend
 
 # Import API key from separate file (not included in git)
 try:
@@ -20,102 +24,58 @@ except ImportError:
     if not OPENAI_API_KEY:
         raise ValueError("OpenAI API key not found. Either set OPENAI_API_KEY environment variable or create an openai_api_key.py file.")
 
-# Set up OpenAI API key
-openai.api_key = OPENAI_API_KEY
 
-def encode_image_to_base64(image_path):
-    """Convert an image file to base64 string."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+MAX_TOKENS = 4096
+MODEL = "gpt-4o"
+
+SYSTEM_PROMPT = """
+You are a data extraction specialist. Your task is to extract structured data from 
+Oman's Customs Tariff tables. The table contains information about tariff codes, 
+descriptions, duty rates, and other data.
+
+For each entry in the table, extract:
+- H.S. Code (the tariff code)
+- Description (in English)
+- Duty Rate (percentage)
+- Any additional codes or identifiers present
+
+Return the data in a structured JSON format. Do not include explanatory text, only the JSON.
+If a page doesn't contain tariff table data, return an empty object with a message.
+"""
+USER_PROMPT = "Extract all tariff data from this page of Oman's Customs Tariff document. Return the results as a JSON array of entries."
+
+RESPONSE_CACHE = ResponseCache()
+# Requests, retries, the response cache and continuation of responses truncated at MAX_TOKENS
+BACKEND = OpenAIBackend(model=MODEL, max_tokens=MAX_TOKENS, api_key=OPENAI_API_KEY, cache=RESPONSE_CACHE,
+                        system_prompt=SYSTEM_PROMPT, prompt=USER_PROMPT)
+
+def encode_image_to_base64(data):
+    """Convert image bytes to a base64 string."""
+    return base64.b64encode(data).decode('utf-8')
 
-def extract_data_from_image(image_base64):
+def extract_data_from_image(image_base64, media_type="image/png", page_num=None):
     """Extract table data using the OpenAI vision model."""
-    response = openai.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {
-                "role": "system",
-                "content": """
-                You are a data extraction specialist. Your task is to extract structured data from 
-                Oman's Customs Tariff tables. The table contains information about tariff codes, 
-                descriptions, duty rates, and other data.
-                
-                For each entry in the table, extract:
-                - H.S. Code (the tariff code)
-                - Description (in English)
-                - Duty Rate (percentage)
-                - Any additional codes or identifiers present
-                
-                Return the data in a structured JSON format. Do not include explanatory text, only the JSON.
-                If a page doesn't contain tariff table data, return an empty object with a message.
-                """
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text", 
-                        "text": "Extract all tariff data from this page of Oman's Customs Tariff document. Return the results as a JSON array of entries."
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{image_base64}"
-                        }
-                    }
-                ]
-            }
-        ],
-        max_tokens=4096
-    )
-    
-    content = response.choices[0].message.content
-    
-    # Try to extract JSON content
-    json_start = content.find('{')
-    json_end = content.rfind('}')
-    
-    if json_start != -1 and json_end != -1:
-        json_str = content[json_start:json_end + 1]
-        try:
-            return json.loads(json_str)
-        except json.JSONDecodeError:
-            # If not valid JSON, try to find array
-            array_start = content.find('[')
-            array_end = content.rfind(']')
-            if array_start != -1 and array_end != -1:
-                json_str = content[array_start:array_end + 1]
-                try:
-                    return {"entries": json.loads(json_str)}
-                except json.JSONDecodeError:
-                    pass
-    
-    # Return raw content if no valid JSON found
-    return {"raw_content": content}
+    return asyncio.run(BACKEND.extract_page(image_base64, media_type, page_num))
 
 def process_single_page(pdf_path, page_num, output_dir):
     """Process a single page from the PDF."""
     os.makedirs(output_dir, exist_ok=True)
     
-    # Convert the page to image
+    # Render the page to a PNG image
     print(f"Converting page {page_num} to image...")
-    images = convert_from_path(pdf_path, first_page=page_num, last_page=page_num)
-    
-    if not images:
-        print(f"Error: Failed to convert page {page_num} to image.")
-        return None
-    
-    # Save the image
-    image_path = os.path.join(output_dir, f"page_{page_num}.png")
-    images[0].save(image_path)
-    print(f"Saved image to {image_path}")
+    png = render_page(pdf_path, page_num)
     
-    # Convert to base64
-    image_base64 = encode_image_to_base64(image_path)
+    # Shrink it for the request (grayscale, cropped, downsampled)
+    image = optimize_page(png, DEFAULT_DPI)
+    print(f"Page {page_num} image: {describe(image)}")
     
-    # Extract data
-    print(f"Extracting data from page {page_num}...")
-    page_data = extract_data_from_image(image_base64)
+    # Save the image in the background and extract data from the in-memory copy
+    with ImageSaver(output_dir) as image_saver:
+        image_path = image_saver.save(page_num, image.data, extension(image))
+        print(f"Saving image to {image_path}")
+        
+        print(f"Extracting data from page {page_num}...")
+        page_data = extract_data_from_image(encode_image_to_base64(image.data), image.media_type, page_num)
     
     # Add page number
     page_data["page_number"] = page_num
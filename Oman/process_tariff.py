@@ -2,114 +2,115 @@ import re
 import pandas as pd
 import json
 
+BIDI_MARKS_RE = re.compile(r'[\u200e\u200f\u202a\u202b\u202c\u202d\u202e]')
+WHITESPACE_RE = re.compile(r'\s+')
+CHAPTER_RE = re.compile(r'Chapter\s+(\d+)')
+HEADING_RE = re.compile(r'(\d{2}\.\d{2})')
+RATE_RE = re.compile(r'(\d+(?:\.\d+)?%)')
+HS_CODE_RE = re.compile(r'^(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})')
+
 def process_file(filename):
+    """
+    Parse the tariff text in a single pass over its lines.
+
+    An HS code line opens an entry and the lines after it are collected as its
+    description until the next blank or HS code line. That line closes the
+    entry and is then classified like any other line. Every line is cleaned and
+    matched against the HS code pattern exactly once, so the run time stays
+    linear however long the description runs are.
+    """
     def clean_text(text):
-        text = re.sub(r'[\u200e\u200f\u202a\u202b\u202c\u202d\u202e]', '', text)
-        text = re.sub(r'\s+', ' ', text)
+        text = BIDI_MARKS_RE.sub('', text)
+        text = WHITESPACE_RE.sub(' ', text)
         return text.strip()
 
     def is_arabic(text):
         return any(ord(c) > 1500 for c in text)
 
+    def make_entry(code_parts, desc_en, desc_ar):
+        return {
+            'chapter': current_chapter,
+            'heading': current_heading,
+            'hs_code': ''.join(code_parts),
+            'code_format': '.'.join(code_parts),
+            'description_en': ' '.join(desc_en),
+            'description_ar': ' '.join(desc_ar),
+            'duty_rate': current_rates['duty'],
+            'efta': current_rates['efta'],
+            'sg': current_rates['sg'],
+            'usa': current_rates['usa']
+        }
+
     data = []
     current_rates = {'duty': None, 'efta': None, 'sg': None, 'usa': None}
-    current_desc_en = []
-    current_desc_ar = []
     current_chapter = None
     current_heading = None
+    # HS code parts of the entry whose description is being collected, if any
+    open_code = None
+    desc_en = []
+    desc_ar = []
 
     with open(filename, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-
-    i = 0
-    while i < len(lines):
-        line = clean_text(lines[i])
-        
-        # Skip empty lines
-        if not line:
-            i += 1
-            continue
-
-        # Look for chapter
-        chapter_match = re.search(r'Chapter\s+(\d+)', line)
-        if chapter_match:
-            current_chapter = chapter_match.group(1)
-            i += 1
-            continue
-
-        # Look for heading
-        heading_match = re.search(r'(\d{2}\.\d{2})', line)
-        if heading_match:
-            current_heading = heading_match.group(1)
-            i += 1
-            continue
-
-        # Check for rates
-        if '%' in line:
-            rate = re.search(r'(\d+(?:\.\d+)?%)', line).group(1)
-            if 'DUTY RATE' in line:
-                current_rates['duty'] = rate
-            elif 'EFTA' in line:
-                current_rates['efta'] = rate
-            elif 'SG' in line:
-                current_rates['sg'] = rate
-            elif 'USA' in line:
-                current_rates['usa'] = rate
-            i += 1
-            continue
-
-        # Look for HS code lines
-        hs_match = re.match(r'^(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})', line)
-        if hs_match:
-            # Get code parts
-            code_parts = hs_match.groups()
-            hs_code = ''.join(code_parts)
-            code_format = '.'.join(code_parts)
-            
-            # Get description from remainder of line
-            remainder = line[hs_match.end():].strip()
-            
-            # Look ahead for description lines
-            desc_en = []
-            desc_ar = []
-            
-            if remainder:
-                if is_arabic(remainder):
-                    desc_ar.append(remainder)
-                else:
-                    desc_en.append(remainder)
-            
-            # Look ahead for more description lines
-            j = i + 1
-            while j < len(lines):
-                next_line = clean_text(lines[j])
-                if not next_line or re.match(r'^\d{2}\s+\d{2}\s+\d{2}\s+\d{2}\s+\d{2}\s+\d{2}', next_line):
-                    break
-                if is_arabic(next_line):
-                    desc_ar.append(next_line)
-                else:
-                    desc_en.append(next_line)
-                j += 1
-            
-            # Create entry
-            entry = {
-                'chapter': current_chapter,
-                'heading': current_heading,
-                'hs_code': hs_code,
-                'code_format': code_format,
-                'description_en': ' '.join(desc_en),
-                'description_ar': ' '.join(desc_ar),
-                'duty_rate': current_rates['duty'],
-                'efta': current_rates['efta'],
-                'sg': current_rates['sg'],
-                'usa': current_rates['usa']
-            }
-            data.append(entry)
-            
-            i = j  # Skip processed description lines
-            continue
-        
-        i += 1
+        for raw_line in f:
+            line = clean_text(raw_line)
+            hs_match = HS_CODE_RE.match(line) if line else None
+
+            if open_code is not None:
+                if line and not hs_match:
+                    if is_arabic(line):
+                        desc_ar.append(line)
+                    else:
+                        desc_en.append(line)
+                    continue
+                # A blank or HS code line ends the description
+                data.append(make_entry(open_code, desc_en, desc_ar))
+                open_code = None
+
+            # Skip empty lines
+            if not line:
+                continue
+
+            # Look for chapter
+            chapter_match = CHAPTER_RE.search(line)
+            if chapter_match:
+                current_chapter = chapter_match.group(1)
+                continue
+
+            # Look for heading
+            heading_match = HEADING_RE.search(line)
+            if heading_match:
+                current_heading = heading_match.group(1)
+                continue
+
+            # Check for rates
+            if '%' in line:
+                rate_match = RATE_RE.search(line)
+                if rate_match:
+                    rate = rate_match.group(1)
+                    if 'DUTY RATE' in line:
+                        current_rates['duty'] = rate
+                    elif 'EFTA' in line:
+                        current_rates['efta'] = rate
+                    elif 'SG' in line:
+                        current_rates['sg'] = rate
+                    elif 'USA' in line:
+                        current_rates['usa'] = rate
+                continue
+
+            # HS code line: open an entry, starting its description with the remainder
+            if hs_match:
+                open_code = hs_match.groups()
+                desc_en = []
+                desc_ar = []
+                remainder = line[hs_match.end():].strip()
+                if remainder:
+                    if is_arabic(remainder):
+                        desc_ar.append(remainder)
+                    else:
+                        desc_en.append(remainder)
+
+    if open_code is not None:
+        data.append(make_entry(open_code, desc_en, desc_ar))
 
     return data
 
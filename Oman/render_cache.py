@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of rendered PDF pages.
+
+A page image is stored under the hash of (PDF content hash, page, DPI, colour
+mode, crop), so reruns after a prompt change reuse every rendered page, while
+a new edition of the PDF or different render settings never hit stale images.
+Files are written atomically (temp file + rename), reads refresh the file's
+mtime, and the least recently used images are evicted once the cache grows
+past its size limit.
+"""
+
+import os
+import json
+import hashlib
+import argparse
+import tempfile
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "TARFAH_RENDER_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".render_cache"))
+DEFAULT_MAX_MB = int(os.environ.get("TARFAH_RENDER_CACHE_MB", "2048"))
+# Evict down to this fraction of the limit, so eviction does not run on every write
+EVICT_TO_FRACTION = 0.9
+FINGERPRINTS_FILE = "fingerprints.json"
+IMAGE_SUFFIX = ".png"
+
+
+def atomic_write(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RenderCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_mb=DEFAULT_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        # Bytes on disk, counted once and then kept up to date by put()
+        self._size = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def pdf_fingerprint(self, pdf_path):
+        """
+        SHA-256 of the PDF's contents.
+
+        The hash is remembered per path, size and mtime, so an unchanged PDF is
+        only read once.
+        """
+        stat = os.stat(pdf_path)
+        path = os.path.abspath(pdf_path)
+        fingerprints_path = os.path.join(self.cache_dir, FINGERPRINTS_FILE)
+        try:
+            with open(fingerprints_path, "r", encoding="utf-8") as f:
+                fingerprints = json.load(f)
+        except (OSError, ValueError):
+            fingerprints = {}
+
+        known = fingerprints.get(path)
+        if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            return known["sha256"]
+
+        sha256 = file_sha256(pdf_path)
+        fingerprints[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+        atomic_write(fingerprints_path, json.dumps(fingerprints, indent=2).encode("utf-8"))
+        return sha256
+
+    @staticmethod
+    def key(fingerprint, page_num, dpi, mode="RGB", crop=None):
+        """Cache key of one rendered page."""
+        params = json.dumps([fingerprint, page_num, dpi, mode, list(crop) if crop else None])
+        return hashlib.sha256(params.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + IMAGE_SUFFIX)
+
+    def contains(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """Return the cached PNG bytes for key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                png = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            # Mark as recently used for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return png
+
+    def put(self, key, png):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        atomic_write(path, png)
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += len(png) - replaced
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(IMAGE_SUFFIX):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_bytes=None):
+        """Delete least recently used images until the cache fits its size limit."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = list(self._entries())
+        total = sum(size for _, size, _ in entries)
+        self._size = total
+        if total <= max_bytes:
+            return 0
+
+        target = max_bytes * EVICT_TO_FRACTION
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._size = total
+        return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or trim the rendered page cache")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Cache directory")
+    parser.add_argument("--max-mb", type=int, default=DEFAULT_MAX_MB, help="Size limit in MB")
+    parser.add_argument("--clear", action="store_true", help="Remove every cached image")
+    args = parser.parse_args()
+
+    cache = RenderCache(args.cache_dir, args.max_mb)
+    if args.clear:
+        cache.evict(max_bytes=0)
+    else:
+        cache.evict()
+    entries = list(cache._entries())
+    print(f"{len(entries)} cached pages, {sum(size for _, size, _ in entries) / 1e6:.1f} MB in {args.cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Local cache of vision model responses.
+
+A response is stored under the SHA-256 of everything that determines it: the
+page image, the system and user prompts, the model and max_tokens. Rerunning a
+batch (after a merge or post-processing fix) then reads the raw response text
+back instead of paying for the same request again; the caller still parses it,
+so parser fixes apply to cached responses too.
+
+Invalidation policy:
+- Any change to the image, a prompt, the model or max_tokens is a new key.
+- Errors are never stored. Responses cut off at max_tokens are stored flagged
+  as truncated, for callers that salvage them and request the remaining rows
+  (get_response); get() and contains() ignore them.
+- Entries older than TARFAH_RESPONSE_CACHE_DAYS (default 90) are misses, since
+  model aliases such as gpt-4o move to new snapshots over time.
+- TARFAH_RESPONSE_CACHE=refresh ignores stored responses and overwrites them,
+  =off bypasses the cache; `python response_cache.py --clear` purges it
+  (optionally only one model, or entries older than N days).
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import argparse
+
+from render_cache import atomic_write
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "TARFAH_RESPONSE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".response_cache"))
+DEFAULT_MAX_AGE_DAYS = float(os.environ.get("TARFAH_RESPONSE_CACHE_DAYS", "90"))
+DEFAULT_MODE = os.environ.get("TARFAH_RESPONSE_CACHE", "on")
+CACHE_MODES = ("on", "refresh", "off")
+
+
+def request_key(image, system_prompt, user_prompt, model, max_tokens):
+    """
+    Cache key of one request.
+
+    image is the PNG bytes or their base64 string; both give the same key.
+    """
+    if isinstance(image, str):
+        image = base64.b64decode(image)
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(image).digest())
+    digest.update(json.dumps([system_prompt, user_prompt, model, max_tokens]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_age_days=DEFAULT_MAX_AGE_DAYS, mode=DEFAULT_MODE):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown response cache mode {mode!r}, expected one of {CACHE_MODES}")
+        self.cache_dir = cache_dir
+        self.max_age = max_age_days * 86400
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        if mode != "off":
+            os.makedirs(cache_dir, exist_ok=True)
+
+    key = staticmethod(request_key)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def _load(self, key, truncated=False):
+        if self.mode != "on":
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - record["created"] > self.max_age:
+            return None
+        if record.get("truncated") and not truncated:
+            return None
+        return record
+
+    def contains(self, key, truncated=False):
+        """
+        Whether a response is cached for key (e.g. to skip rate limiting for it).
+
+        Truncated responses only count with truncated=True.
+        """
+        return self._load(key, truncated) is not None
+
+    def get_response(self, key):
+        """Return (content, truncated) for key, including truncated responses, or None."""
+        record = self._load(key, truncated=True)
+        if record is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return record["content"], bool(record.get("truncated"))
+
+    def get(self, key):
+        """Return the cached text of a complete response for key, or None."""
+        record = self._load(key)
+        if record is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return record["content"]
+
+    def put(self, key, content, model, usage=None, truncated=False):
+        """Store a response; truncated marks one that was cut off at max_tokens."""
+        if self.mode == "off":
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        record = {"created": time.time(), "model": model, "usage": usage, "content": content}
+        if truncated:
+            record["truncated"] = True
+        atomic_write(path, json.dumps(record, ensure_ascii=False).encode("utf-8"))
+
+    def _records(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        with open(path, "r", encoding="utf-8") as f:
+                            yield path, json.load(f)
+                    except (OSError, ValueError):
+                        continue
+
+    def purge(self, model=None, older_than_days=None):
+        """Delete stored responses, optionally only those of one model or older than N days."""
+        removed = 0
+        for path, record in self._records():
+            if model and record.get("model") != model:
+                continue
+            if older_than_days is not None and time.time() - record["created"] <= older_than_days * 86400:
+                continue
+            os.remove(path)
+            removed += 1
+        return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or purge the vision model response cache")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Cache directory")
+    parser.add_argument("--clear", action="store_true", help="Delete cached responses")
+    parser.add_argument("--model", help="With --clear, only delete responses from this model")
+    parser.add_argument("--older-than", type=float, help="With --clear, only delete responses older than N days")
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.cache_dir)
+    if args.clear:
+        print(f"Removed {cache.purge(args.model, args.older_than)} cached responses")
+
+    models = {}
+    for _, record in cache._records():
+        models[record.get("model")] = models.get(record.get("model"), 0) + 1
+    for model, count in sorted(models.items(), key=lambda item: str(item[0])):
+        print(f"{model}: {count} cached responses")
+    print(f"{sum(models.values())} cached responses in {args.cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
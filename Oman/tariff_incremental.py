@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Incremental re-parse of tarfah.txt keyed on per-chapter content hashes.
+
+The text is split at every "Chapter N" line and each chapter chunk is hashed.
+A chunk's parse result (with its inherited context left as placeholders) only
+depends on its own text, so results for unchanged chapters are reused from the
+previous run's cache directory (one chunk-<hash>.json file per chunk) and only
+changed chapters are parsed again. Merging then resolves the context across chapters,
+which gives exactly the output of a full parse.
+"""
+
+import os
+import re
+import json
+import hashlib
+import argparse
+
+from tariff_parser import split_chapter_chunks, parse_chunk, merge_chunk_results, save_data
+
+# Bump when the parser's output for a given chunk changes, to invalidate old caches
+CACHE_VERSION = 1
+# Names of chunk cache files; only these are ever removed from the cache directory
+CHUNK_FILE_RE = re.compile(r'^chunk-([0-9a-f]{64})\.json$')
+
+
+def chunk_key(lines, inherit):
+    """Content hash of a chapter chunk (the first chunk parses without inherited context)."""
+    prefix = f"v{CACHE_VERSION}:{'inherit' if inherit else 'first'}:"
+    return hashlib.sha256((prefix + ''.join(lines)).encode('utf-8')).hexdigest()
+
+
+def chunk_path(cache_dir, key):
+    return os.path.join(cache_dir, f"chunk-{key}.json")
+
+
+def load_chunk(cache_dir, key):
+    try:
+        with open(chunk_path(cache_dir, key), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_chunk(cache_dir, key, result):
+    path = chunk_path(cache_dir, key)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def parse_file_incremental(file_path, cache_dir):
+    """
+    Parse file_path, re-parsing only the chapters whose text changed since the cached run.
+
+    Only new chunk results are written. Chunk files that this version of the
+    file no longer uses are removed afterwards; other files in cache_dir are
+    left alone.
+
+    Returns:
+        (entries, number of chapter chunks re-parsed, total number of chunks)
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    os.makedirs(cache_dir, exist_ok=True)
+
+    used = set()
+    chunk_results = []
+    parsed = 0
+    for index, chunk in enumerate(split_chapter_chunks(lines)):
+        inherit = index > 0
+        key = chunk_key(chunk, inherit)
+        result = load_chunk(cache_dir, key)
+        if result is None:
+            chunk_entries, chunk_context = parse_chunk(chunk, inherit)
+            result = {'entries': chunk_entries, 'context': chunk_context}
+            save_chunk(cache_dir, key, result)
+            parsed += 1
+        used.add(key)
+        chunk_results.append((result['entries'], result['context']))
+
+    for name in os.listdir(cache_dir):
+        match = CHUNK_FILE_RE.match(name)
+        if match and match.group(1) not in used:
+            os.remove(os.path.join(cache_dir, name))
+
+    return merge_chunk_results(chunk_results), parsed, len(chunk_results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally re-parse the Oman Customs Tariff text")
+    parser.add_argument("--input", default="tarfah.txt", help="Path to the tariff text file")
+    parser.add_argument("--output", default="oman_tariff_data_final4", help="Output base filename (without extension)")
+    parser.add_argument("--cache-dir", help="Chapter chunk cache directory (default: <output>_chunks)")
+    args = parser.parse_args()
+
+    cache_dir = args.cache_dir or f"{args.output}_chunks"
+    entries, parsed, total = parse_file_incremental(args.input, cache_dir)
+    print(f"Re-parsed {parsed} of {total} chapter chunks")
+    save_data(entries, args.output)
+
+
+if __name__ == "__main__":
+    main()
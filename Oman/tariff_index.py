@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Byte-offset index of Sections, Chapters and headings in tarfah.txt.
+
+The index is built with one full parse and persisted next to the text file.
+For every run of consecutive entries that share a section, chapter or heading
+it stores the byte range to re-parse and the parser context at the start of
+that range. Parsing a chapter or heading then only reads its own bytes, and the
+entries come out identical to the matching entries of a full parse.
+"""
+
+import os
+import re
+import json
+import mmap
+import argparse
+
+from tariff_parser import TariffParser, clean_text, save_data
+
+INDEX_SUFFIX = ".index.json"
+INDEX_KINDS = ('section', 'chapter', 'heading')
+
+# Full-line "Section XI" / "Section 2" titles; mentions inside notes are longer lines
+SECTION_RE = re.compile(r'^Section ([IVXL]+|\d+)$')
+
+
+def index_path_for(file_path):
+    return f"{file_path}{INDEX_SUFFIX}"
+
+
+def file_signature(file_path):
+    """Size and mtime of the text file, used to detect a stale index."""
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def iter_offset_lines(mm, start=0, end=None):
+    """Yield (offset, raw line) pairs from a memory map between two byte offsets."""
+    end = len(mm) if end is None else end
+    mm.seek(start)
+    offset = start
+    while offset < end:
+        raw = mm.readline()
+        if not raw:
+            break
+        yield offset, raw
+        offset += len(raw)
+
+
+def _section_title(raw):
+    if b'Section' not in raw:
+        return None
+    match = SECTION_RE.match(clean_text(raw.decode('utf-8')))
+    return match.group(1) if match else None
+
+
+def build_index(file_path):
+    """
+    Parse the whole file once and record the runs of each section, chapter and heading.
+
+    A run starts at the line that changed to its value before its first entry and
+    ends where the next run's first entry starts, so it also covers the
+    description lines of its last entry.
+    """
+    parser = TariffParser()
+    runs = {kind: [] for kind in INDEX_KINDS}
+    # Per kind: (value, offset, context) of the most recent line that changed the value
+    last_set = dict.fromkeys(INDEX_KINDS, (None, 0, None))
+    open_runs = dict.fromkeys(INDEX_KINDS)
+    section = None
+    index = {'source': {'path': os.path.basename(file_path), **file_signature(file_path)},
+             'runs': runs}
+    if index['source']['size'] == 0:
+        return index
+
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for offset, raw in iter_offset_lines(mm):
+            before = parser.get_context()
+            entry_before = parser.current_entry
+
+            title = _section_title(raw)
+            if title:
+                section = title
+                last_set['section'] = (section, offset, before)
+
+            parser.parse_bytes_line(raw)
+
+            if parser.current_chapter != before['chapter']:
+                last_set['chapter'] = (parser.current_chapter, offset, before)
+            if parser.current_heading != before['heading']:
+                last_set['heading'] = (parser.current_heading, offset, before)
+
+            if parser.current_entry is entry_before:
+                continue
+
+            # A new entry started on this line
+            values = {'section': section,
+                      'chapter': parser.current_chapter,
+                      'heading': parser.current_heading}
+            for kind in INDEX_KINDS:
+                run = open_runs[kind]
+                if run is not None and run['key'] == values[kind]:
+                    continue
+                if run is not None:
+                    run['end'] = offset
+                    open_runs[kind] = None
+                if values[kind] is None:
+                    continue
+                _, start, context = last_set[kind]
+                run = {'key': values[kind], 'start': start, 'end': None, 'context': context}
+                runs[kind].append(run)
+                open_runs[kind] = run
+
+        for run in open_runs.values():
+            if run is not None:
+                run['end'] = len(mm)
+
+    return index
+
+
+def save_index(index, index_path):
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, index_path)
+
+
+def load_index(file_path, rebuild=True):
+    """Load the persisted index for file_path, rebuilding it when missing or stale."""
+    index_path = index_path_for(file_path)
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        source = index['source']
+        if {'size': source['size'], 'mtime_ns': source['mtime_ns']} == file_signature(file_path):
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if not rebuild:
+        raise ValueError(f"No up-to-date index for {file_path}")
+    index = build_index(file_path)
+    save_index(index, index_path)
+    return index
+
+
+def parse_range(file_path, start, end, context):
+    """Parse only the bytes [start, end) of the file, starting from the given context."""
+    parser = TariffParser(context)
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for _, raw in iter_offset_lines(mm, start, end):
+            parser.parse_bytes_line(raw)
+    return [record.to_dict() for record in parser.finish()]
+
+
+def _in_range(kind, key, first, last):
+    if kind == 'chapter':
+        return int(first) <= int(key) <= int(last)
+    if kind == 'heading':
+        return first <= key <= last
+    # Section titles are roman or arabic numerals as written, so no ordering
+    return key in (first, last)
+
+
+def find_runs(index, kind, first, last=None):
+    """Return the runs of one kind whose key is first, or lies between first and last."""
+    last = first if last is None else last
+    return [run for run in index['runs'][kind] if _in_range(kind, run['key'], first, last)]
+
+
+def parse_indexed(file_path, kind, first, last=None, index=None):
+    """
+    Parse only the given section, chapter or heading (or an inclusive range).
+
+    Returns exactly the entries a full parse produces for those keys, in document order.
+    """
+    index = index or load_index(file_path)
+    entries = []
+    for run in find_runs(index, kind, first, last):
+        entries.extend(parse_range(file_path, run['start'], run['end'], run['context']))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index tarfah.txt and re-parse single chapters or headings")
+    parser.add_argument("--input", default="tarfah.txt", help="Path to the tariff text file")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index even if it is up to date")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--section", help="Section title as written (e.g. XI)")
+    group.add_argument("--chapter", nargs='+', help="Chapter number, or first and last chapter")
+    group.add_argument("--heading", nargs='+', help="Heading (e.g. 01.01), or first and last heading")
+    parser.add_argument("--output", help="Output base filename for the parsed entries")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        index = build_index(args.input)
+        save_index(index, index_path_for(args.input))
+    else:
+        index = load_index(args.input)
+    counts = ', '.join(f"{len(index['runs'][kind])} {kind} runs" for kind in INDEX_KINDS)
+    print(f"Index: {counts}")
+
+    if args.section:
+        kind, keys = 'section', [args.section]
+    elif args.chapter:
+        kind, keys = 'chapter', args.chapter
+    elif args.heading:
+        kind, keys = 'heading', args.heading
+    else:
+        return
+
+    entries = parse_indexed(args.input, kind, *keys[:2], index=index)
+    if args.output:
+        save_data(entries, args.output)
+    else:
+        print(json.dumps(entries, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
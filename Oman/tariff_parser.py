@@ -0,0 +1,705 @@
+#!/usr/bin/env python3
+"""
+Unified single-pass parser for the text version of Oman's Customs Tariff (tarfah.txt).
+
+Every line is cleaned once and classified once against a table of precompiled
+rules (chapter, heading, rate, HS code, description). The record schema and the
+classification order are the same as parse_tariff_final4.py, so both produce
+identical entries; this module just does it with far less per-line regex work.
+"""
+
+import os
+import re
+import sys
+import csv
+import json
+import mmap
+import time
+import argparse
+import concurrent.futures
+from collections import Counter
+
+# Characters removed by clean_text (RTL/LTR marks and embedding controls)
+BIDI_MARKS_RE = re.compile(r'[\u200e\u200f\u202a\u202b\u202c\u202d\u202e]')
+
+CHAPTER_RE = re.compile(r'Chapter\s+(\d+)')
+HEADING_RE = re.compile(r'(\d{2}\.\d{2})')
+RATE_RE = re.compile(r'(\d+(?:\.\d+)?%)')
+HS_CODE_RE = re.compile(r'^(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})')
+ARABIC_RE = re.compile(r'[\u0600-\u06ff\u0750-\u077f\u08a0-\u08ff\ufb50-\ufdff\ufe70-\ufeff]')
+
+# Page/table labels that are never part of a description
+SKIP_MARKERS = ('HEADING', 'H.S CODE', 'DESCRIPTION')
+SKIP_MARKERS_RE = re.compile('|'.join(re.escape(marker) for marker in SKIP_MARKERS))
+
+# Bytes versions of the rules, used by the mmap scanner on pure-ASCII lines.
+# For ASCII input they match exactly what the str patterns above match.
+CHAPTER_BYTES_RE = re.compile(rb'Chapter\s+(\d+)')
+HEADING_BYTES_RE = re.compile(rb'(\d{2}\.\d{2})')
+RATE_BYTES_RE = re.compile(rb'(\d+(?:\.\d+)?%)')
+HS_CODE_BYTES_RE = re.compile(rb'^(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})')
+SKIP_MARKERS_BYTES_RE = re.compile(SKIP_MARKERS_RE.pattern.encode('ascii'))
+# str.split() also treats the ASCII separators \x1c-\x1f as whitespace; bytes.split() does not
+ASCII_SEPARATORS_TABLE = bytes.maketrans(b'\x1c\x1d\x1e\x1f', b'    ')
+CARRIAGE_RETURN = ord('\r')
+
+# Output record schema, in column order (same as parse_tariff_final4.py)
+ENTRY_FIELDS = ('chapter', 'heading', 'hs_code', 'code_format', 'description_en',
+                'description_ar', 'duty_rate', 'efta', 'sg', 'usa')
+
+# Parser state carried from one line to the next; parallel chunks inherit it
+CONTEXT_FIELDS = ('chapter', 'heading', 'duty_rate', 'efta', 'sg', 'usa')
+# Placeholder for context a chunk inherits from the chunks before it. Rule
+# captures are digits and '%', so this can never collide with a real value.
+INHERITED = '\x00inherited'
+
+# Aim for a few chunks per worker so uneven chapters still balance out
+CHUNKS_PER_WORKER = 4
+
+# Page furniture: lines on at least this share of pages, about once per page
+PAGE_BREAK = '\x0c'
+FURNITURE_MIN_PAGE_FRACTION = 0.15
+FURNITURE_MAX_PER_PAGE = 1.15
+
+# Rule table, evaluated in order. Each rule is (name, guard, pattern, handler):
+# the guard is a substring the pattern cannot match without, so most lines are
+# rejected by a cheap `in` test before any regex runs.
+RULES = (
+    ('chapter', 'Chapter', CHAPTER_RE.search, '_on_chapter'),
+    ('heading', '.', HEADING_RE.search, '_on_heading'),
+    ('rate', '%', RATE_RE.search, '_on_rate'),
+    ('hs_code', None, HS_CODE_RE.match, '_on_hs_code'),
+)
+
+# Guards here are single byte values: `int in bytes` is a plain memchr, while a
+# bytes substring test costs several times more than its str counterpart.
+BYTES_RULES = (
+    ('chapter', ord('C'), CHAPTER_BYTES_RE.search, '_on_chapter_bytes'),
+    ('heading', ord('.'), HEADING_BYTES_RE.search, '_on_heading_bytes'),
+    ('rate', ord('%'), RATE_BYTES_RE.search, '_on_rate_bytes'),
+    ('hs_code', None, HS_CODE_BYTES_RE.match, '_on_hs_code_bytes'),
+)
+
+
+def clean_text(text):
+    """Clean text from unwanted characters and normalize spaces."""
+    # Most lines are plain ASCII and cannot contain direction marks
+    if not text.isascii():
+        text = BIDI_MARKS_RE.sub('', text)
+    # str.split() uses the same whitespace definition as the \s+ substitution
+    return ' '.join(text.split())
+
+
+def matches_rule(line):
+    """Check if a cleaned line would be classified by one of the parser rules."""
+    return any((guard is None or guard in line) and matcher(line)
+               for _, guard, matcher, _ in RULES)
+
+
+def detect_page_furniture(lines, min_page_fraction=FURNITURE_MIN_PAGE_FRACTION,
+                          max_per_page=FURNITURE_MAX_PER_PAGE):
+    """
+    Find repeated page headers and footers by frequency.
+
+    Pages are separated by form feeds. A cleaned line is furniture when it shows
+    up on at least min_page_fraction of the pages and not much more than once
+    per page (column titles, banners), as opposed to short table values like
+    "A" or "- - Other" that repeat many times per page. Lines that a parser
+    rule would act on (chapter, heading, rate, HS code) are never furniture.
+
+    Returns:
+        frozenset of cleaned lines
+    """
+    page_counts = Counter()
+    total_counts = Counter()
+    pages = 1
+    seen = set()
+    for raw in lines:
+        for index, part in enumerate(raw.split(PAGE_BREAK)):
+            if index:
+                pages += 1
+                seen = set()
+            line = clean_text(part)
+            if not line:
+                continue
+            total_counts[line] += 1
+            if line not in seen:
+                seen.add(line)
+                page_counts[line] += 1
+
+    if pages < 2:
+        return frozenset()
+    min_pages = max(2, min_page_fraction * pages)
+    return frozenset(line for line, count in page_counts.items()
+                     if count >= min_pages and total_counts[line] <= max_per_page * count
+                     and not matches_rule(line))
+
+
+def is_arabic(text):
+    """Check if text contains Arabic characters."""
+    return not text.isascii() and ARABIC_RE.search(text) is not None
+
+
+class TariffEntry:
+    # page is only known when parsing straight from the PDF (see tariff_pdf_text.py)
+    __slots__ = ENTRY_FIELDS + ('page',)
+
+    def __init__(self, chapter=None, heading=None):
+        self.chapter = chapter
+        self.heading = heading
+        self.page = None
+        self.hs_code = None
+        self.code_format = None
+        self.description_en = []
+        self.description_ar = []
+        self.duty_rate = None
+        self.efta = None
+        self.sg = None
+        self.usa = None
+
+    def add_description(self, text):
+        if is_arabic(text):
+            self.description_ar.append(text)
+        else:
+            self.description_en.append(text)
+
+    def to_dict(self):
+        return {
+            'chapter': self.chapter,
+            'heading': self.heading,
+            'hs_code': self.hs_code,
+            'code_format': self.code_format,
+            'description_en': ' '.join(self.description_en),
+            'description_ar': ' '.join(self.description_ar),
+            'duty_rate': self.duty_rate,
+            'efta': self.efta,
+            'sg': self.sg,
+            'usa': self.usa
+        }
+
+
+class TariffTable:
+    """
+    Column-oriented store of finished entries.
+
+    Each field is one list, and the few distinct chapter/heading/rate values are
+    interned so every row shares the same string objects. The columns feed
+    pandas or Arrow directly, without building a dict per row.
+    """
+
+    def __init__(self):
+        self.columns = {field: [] for field in ENTRY_FIELDS}
+        self._appenders = [(field, self.columns[field].append) for field in ENTRY_FIELDS]
+
+    @classmethod
+    def from_records(cls, records):
+        table = cls()
+        for record in records:
+            table.append(record)
+        return table
+
+    def append(self, entry):
+        """Append a finished TariffEntry."""
+        for field, append in self._appenders:
+            value = getattr(entry, field)
+            if field in CONTEXT_FIELDS:
+                if value is not None:
+                    value = sys.intern(value)
+            elif field in ('description_en', 'description_ar'):
+                value = ' '.join(value)
+            append(value)
+
+    def __len__(self):
+        return len(self.columns['hs_code'])
+
+    def __iter__(self):
+        """Yield rows as dicts, one at a time (e.g. for save_data)."""
+        for values in zip(*self.columns.values()):
+            yield dict(zip(ENTRY_FIELDS, values))
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame(self.columns, columns=list(ENTRY_FIELDS))
+
+    def to_arrow(self):
+        import pyarrow as pa
+        return pa.table(self.columns)
+
+
+class RuleProfile:
+    """
+    Hit counts and time per classification step, collected by TariffParser(profile=True).
+
+    Each rule is charged for its guard test and regex on every line that reaches
+    it, plus its handler on the lines it claims, so the totals show what each
+    step really costs in the evaluation order. Overlaps count lines claimed by a
+    rule that a later rule would also have matched (e.g. the heading pattern
+    firing inside rate lines); they are checked outside the timed sections.
+    """
+
+    STEPS = ('clean', 'blank', 'furniture') + tuple(rule[0] for rule in RULES) + ('description',)
+
+    def __init__(self):
+        self.lines = 0
+        self.tried = Counter()
+        self.hits = Counter()
+        self.seconds = Counter()
+        self.overlaps = Counter()
+
+    def as_dict(self):
+        return {
+            'lines': self.lines,
+            'steps': {step: {'tried': self.tried[step], 'hits': self.hits[step],
+                             'seconds': self.seconds[step]} for step in self.STEPS},
+            'overlaps': {f"{claimed}>{other}": count for (claimed, other), count in self.overlaps.items()},
+        }
+
+    def report(self, file=None):
+        """Print the per-step table and the rule overlaps."""
+        file = file or sys.stdout
+        total = sum(self.seconds.values())
+        print(f"Rule profile: {self.lines} lines, {total:.3f}s in parse_line", file=file)
+        print(f"{'step':<12} {'tried':>9} {'hits':>9} {'hit %':>7} {'total ms':>10} {'ns/line':>8} {'share':>7}",
+              file=file)
+        for step in self.STEPS:
+            tried, hits, seconds = self.tried[step], self.hits[step], self.seconds[step]
+            hit_rate = 100 * hits / tried if tried else 0
+            # Guard rejections are charged too, so spread the cost over all input lines
+            per_line = 1e9 * seconds / self.lines if self.lines else 0
+            share = 100 * seconds / total if total else 0
+            print(f"{step:<12} {tried:>9} {hits:>9} {hit_rate:>6.1f}% {1e3 * seconds:>10.1f} "
+                  f"{per_line:>8.1f} {share:>6.1f}%", file=file)
+        if self.overlaps:
+            print("Lines claimed by one rule that a later rule also matches:", file=file)
+            for (claimed, other), count in self.overlaps.most_common():
+                print(f"  {claimed} shadows {other}: {count}", file=file)
+
+
+class TariffParser:
+    def __init__(self, context=None, furniture=None, profile=False):
+        self.entries = []
+        self.current_entry = None
+        self.current_chapter = None
+        self.current_heading = None
+        self.last_rates = {'duty_rate': None, 'efta': None, 'sg': None, 'usa': None}
+        if context:
+            self.set_context(context)
+        # Cleaned page furniture lines (see detect_page_furniture) to drop before classification
+        self.furniture = frozenset(furniture or ())
+        self.furniture_bytes = frozenset(line.encode('ascii') for line in self.furniture if line.isascii())
+        self.skipped_lines = 0
+        # Bind the rule handlers once instead of looking them up per line
+        self.rules = [(name, guard, matcher, getattr(self, handler))
+                      for name, guard, matcher, handler in RULES]
+        self.bytes_rules = [(name, guard, matcher, getattr(self, handler))
+                            for name, guard, matcher, handler in BYTES_RULES]
+        # Opt-in instrumentation: the instance attribute shadows parse_line, so
+        # unprofiled parsers keep the plain method with no timing overhead
+        self.profile = RuleProfile() if profile else None
+        if profile:
+            self.parse_line = self._parse_line_profiled
+
+    def get_context(self):
+        """Return the chapter/heading/rate state that the next line would inherit."""
+        return {'chapter': self.current_chapter, 'heading': self.current_heading, **self.last_rates}
+
+    def set_context(self, context):
+        self.current_chapter = context['chapter']
+        self.current_heading = context['heading']
+        for key in self.last_rates:
+            self.last_rates[key] = context[key]
+
+    def _on_chapter(self, line, match):
+        self.current_chapter = match.group(1)
+
+    def _on_heading(self, line, match):
+        self.current_heading = match.group(1)
+
+    def _on_rate(self, line, match):
+        rate = match.group(1)
+        if 'DUTY RATE' in line or 'duty rate' in line.lower():
+            self.last_rates['duty_rate'] = rate
+        elif 'EFTA' in line:
+            self.last_rates['efta'] = rate
+        elif 'SG' in line:
+            self.last_rates['sg'] = rate
+        elif 'USA' in line:
+            self.last_rates['usa'] = rate
+
+    def _on_hs_code(self, line, match):
+        self._start_entry(match.groups(), line[match.end():].strip())
+
+    def _on_chapter_bytes(self, line, match):
+        self.current_chapter = match.group(1).decode('ascii')
+
+    def _on_heading_bytes(self, line, match):
+        self.current_heading = match.group(1).decode('ascii')
+
+    def _on_rate_bytes(self, line, match):
+        rate = match.group(1).decode('ascii')
+        if b'DUTY RATE' in line or b'duty rate' in line.lower():
+            self.last_rates['duty_rate'] = rate
+        elif b'EFTA' in line:
+            self.last_rates['efta'] = rate
+        elif b'SG' in line:
+            self.last_rates['sg'] = rate
+        elif b'USA' in line:
+            self.last_rates['usa'] = rate
+
+    def _on_hs_code_bytes(self, line, match):
+        code_parts = tuple(part.decode('ascii') for part in match.groups())
+        self._start_entry(code_parts, line[match.end():].strip().decode('ascii'))
+
+    def _start_entry(self, code_parts, remainder):
+        if self.current_entry:
+            self.entries.append(self.current_entry)
+
+        entry = TariffEntry(self.current_chapter, self.current_heading)
+        entry.hs_code = ''.join(code_parts)
+        entry.code_format = '.'.join(code_parts)
+
+        # Apply last known rates
+        entry.duty_rate = self.last_rates['duty_rate']
+        entry.efta = self.last_rates['efta']
+        entry.sg = self.last_rates['sg']
+        entry.usa = self.last_rates['usa']
+
+        # Get description from remainder of line
+        if remainder:
+            entry.add_description(remainder)
+        self.current_entry = entry
+
+    def _on_description(self, line):
+        if self.current_entry and not SKIP_MARKERS_RE.search(line):
+            self.current_entry.add_description(line)
+
+    def parse_line(self, line):
+        line = clean_text(line)
+        if not line:
+            return
+        if line in self.furniture:
+            self.skipped_lines += 1
+            return
+
+        for name, guard, matcher, handler in self.rules:
+            if guard is not None and guard not in line:
+                continue
+            match = matcher(line)
+            if match:
+                handler(line, match)
+                return
+
+        # Anything that didn't match a rule may be a description continuation
+        self._on_description(line)
+
+    def _parse_line_profiled(self, line):
+        """parse_line with every step counted and timed into self.profile."""
+        profile = self.profile
+        tried, hits, seconds = profile.tried, profile.hits, profile.seconds
+        clock = time.perf_counter
+        profile.lines += 1
+
+        start = clock()
+        line = clean_text(line)
+        seconds['clean'] += clock() - start
+        tried['clean'] += 1
+        tried['blank'] += 1
+        if not line:
+            hits['blank'] += 1
+            return
+        tried['furniture'] += 1
+        if line in self.furniture:
+            hits['furniture'] += 1
+            self.skipped_lines += 1
+            return
+
+        for index, (name, guard, matcher, handler) in enumerate(self.rules):
+            start = clock()
+            if guard is not None and guard not in line:
+                seconds[name] += clock() - start
+                continue
+            tried[name] += 1
+            match = matcher(line)
+            if match:
+                handler(line, match)
+                seconds[name] += clock() - start
+                hits[name] += 1
+                for other, other_guard, other_matcher, _ in self.rules[index + 1:]:
+                    if (other_guard is None or other_guard in line) and other_matcher(line):
+                        profile.overlaps[name, other] += 1
+                return
+            seconds[name] += clock() - start
+
+        start = clock()
+        self._on_description(line)
+        seconds['description'] += clock() - start
+        tried['description'] += 1
+        hits['description'] += 1
+
+    def parse_bytes_line(self, raw):
+        """
+        Parse one raw UTF-8 line without decoding it unless it becomes a description.
+
+        Pure-ASCII lines are cleaned and classified with the bytes rules; any other
+        line is decoded and handed to parse_line, so results match the str parser.
+        """
+        if not raw.isascii():
+            self.parse_line(raw.decode('utf-8'))
+            return
+        if CARRIAGE_RETURN in raw:
+            # Text-mode reads treat a bare \r as a line break as well
+            for part in raw.split(b'\r'):
+                self.parse_bytes_line(part)
+            return
+
+        line = b' '.join(raw.translate(ASCII_SEPARATORS_TABLE).split())
+        if not line:
+            return
+        if line in self.furniture_bytes:
+            self.skipped_lines += 1
+            return
+
+        for name, guard, matcher, handler in self.bytes_rules:
+            if guard is not None and guard not in line:
+                continue
+            match = matcher(line)
+            if match:
+                handler(line, match)
+                return
+
+        if self.current_entry and not SKIP_MARKERS_BYTES_RE.search(line):
+            # ASCII text is never Arabic
+            self.current_entry.description_en.append(line.decode('ascii'))
+
+    def finish(self):
+        """Close the entry in progress and return all finished TariffEntry records."""
+        if self.current_entry:
+            self.entries.append(self.current_entry)
+            self.current_entry = None
+        return self.entries
+
+    def iter_records(self, file_path, use_mmap=False):
+        """
+        Parse a file and yield each TariffEntry as soon as it is complete.
+
+        An entry is complete when the next HS code line starts a new one (or the
+        file ends), so only the entry in progress is held in memory.
+        """
+        if use_mmap:
+            lines, parse = iter_mmap_lines(file_path), self.parse_bytes_line
+        else:
+            lines, parse = iter_text_lines(file_path), self.parse_line
+
+        finished = self.entries
+        for line in lines:
+            parse(line)
+            if finished:
+                yield from finished
+                finished.clear()
+
+        self.finish()
+        yield from finished
+        finished.clear()
+
+    def iter_entries(self, file_path, use_mmap=False):
+        """Like iter_records, but yield each entry in the dict record schema."""
+        for record in self.iter_records(file_path, use_mmap):
+            yield record.to_dict()
+
+    def parse_table(self, file_path, use_mmap=False):
+        """Parse a file into a columnar TariffTable."""
+        return TariffTable.from_records(self.iter_records(file_path, use_mmap))
+
+    def parse_file(self, file_path):
+        return list(self.iter_entries(file_path))
+
+    def parse_file_mmap(self, file_path):
+        """Parse the file through a read-only memory map, one line at a time."""
+        return list(self.iter_entries(file_path, use_mmap=True))
+
+
+def iter_text_lines(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        yield from f
+
+
+def iter_mmap_lines(file_path):
+    """Yield raw byte lines from a read-only memory map of the file."""
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from iter(mm.readline, b'')
+
+
+def split_chapter_chunks(lines, target_chunks=None):
+    """
+    Split lines into about target_chunks slices that each start at a "Chapter N" line.
+
+    Without a target, every "Chapter N" line starts a new slice.
+    """
+    chapter_starts = [i for i, line in enumerate(lines)
+                      if 'Chapter' in line and CHAPTER_RE.search(line)]
+    min_size = max(1, len(lines) // target_chunks) if target_chunks else 1
+
+    bounds = [0]
+    for start in chapter_starts:
+        if start - bounds[-1] >= min_size:
+            bounds.append(start)
+    bounds.append(len(lines))
+    return [lines[begin:end] for begin, end in zip(bounds, bounds[1:])]
+
+
+def parse_chunk(lines, inherit, furniture=None):
+    """
+    Parse one chunk in a worker process.
+
+    When inherit is set, the chunk starts with placeholder context and an open
+    "carry" entry that collects description lines belonging to the last entry
+    of the previous chunk. Both are resolved by merge_chunk_results. Lines in
+    furniture (see detect_page_furniture) are dropped as in the serial parser.
+
+    Returns:
+        (entries, final context) - entries[0] is the carry entry when inherit is set
+    """
+    if inherit:
+        parser = TariffParser(dict.fromkeys(CONTEXT_FIELDS, INHERITED), furniture=furniture)
+        parser.current_entry = TariffEntry()
+    else:
+        parser = TariffParser(furniture=furniture)
+    for line in lines:
+        parser.parse_line(line)
+    return [record.to_dict() for record in parser.finish()], parser.get_context()
+
+
+def _join_description(head, tail):
+    if head and tail:
+        return f"{head} {tail}"
+    return head or tail
+
+
+def merge_chunk_results(chunk_results):
+    """Merge (entries, context) chunk results in document order, filling in inherited context."""
+    entries = []
+    context = None
+    for index, (chunk_entries, chunk_context) in enumerate(chunk_results):
+        if index > 0:
+            carry = chunk_entries[0]
+            chunk_entries = chunk_entries[1:]
+            # Without an open entry the serial parser drops these lines too
+            if entries:
+                last = entries[-1]
+                last['description_en'] = _join_description(last['description_en'], carry['description_en'])
+                last['description_ar'] = _join_description(last['description_ar'], carry['description_ar'])
+
+            for entry in chunk_entries:
+                for field in CONTEXT_FIELDS:
+                    if entry[field] == INHERITED:
+                        entry[field] = context[field]
+            chunk_context = {field: context[field] if value == INHERITED else value
+                             for field, value in chunk_context.items()}
+
+        entries.extend(chunk_entries)
+        context = chunk_context
+    return entries
+
+
+def parse_file_parallel(file_path, workers=None, furniture=None):
+    """
+    Parse the tariff text across a process pool.
+
+    The file is split at "Chapter N" lines, each chunk is parsed independently,
+    and the results are merged in document order. Output is identical to
+    TariffParser(furniture=furniture).parse_file(file_path).
+    """
+    workers = workers or os.cpu_count() or 1
+    with open(file_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    chunks = split_chapter_chunks(lines, workers * CHUNKS_PER_WORKER)
+    if workers == 1 or len(chunks) == 1:
+        chunk_results = [parse_chunk(chunk, index > 0, furniture) for index, chunk in enumerate(chunks)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            chunk_results = list(executor.map(parse_chunk, chunks,
+                                              [index > 0 for index in range(len(chunks))],
+                                              [furniture] * len(chunks)))
+    return merge_chunk_results(chunk_results)
+
+
+def write_entries(entries, json_file, csv_file):
+    """
+    Write entries to JSON and CSV as they arrive from any iterable.
+
+    The files are byte-for-byte what json.dump(entries, indent=2, ensure_ascii=False)
+    and pandas' DataFrame(entries).to_csv(index=False) would produce, without
+    holding all entries (or a DataFrame copy of them) in memory.
+
+    Returns:
+        Number of entries written
+    """
+    count = 0
+    with open(json_file, 'w', encoding='utf-8') as jf, \
+            open(csv_file, 'w', encoding='utf-8', newline='') as cf:
+        writer = None
+        for entry in entries:
+            if writer is None:
+                writer = csv.writer(cf, lineterminator='\n')
+                writer.writerow(entry.keys())
+                jf.write('[\n  ')
+            else:
+                jf.write(',\n  ')
+            jf.write(json.dumps(entry, indent=2, ensure_ascii=False).replace('\n', '\n  '))
+            writer.writerow(entry.values())
+            count += 1
+
+        jf.write('\n]' if count else '[]')
+        if writer is None:
+            cf.write('\n')
+    return count
+
+
+def save_data(data, base_filename):
+    """Save the parsed data in multiple formats, streaming from a list or generator."""
+    json_file = f"{base_filename}.json"
+    csv_file = f"{base_filename}.csv"
+    count = write_entries(data, json_file, csv_file)
+
+    print(f"Processed {count} tariff entries")
+    print(f"Data saved to {json_file} and {csv_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse the Oman Customs Tariff text (tarfah.txt)")
+    parser.add_argument("--input", default="tarfah.txt", help="Path to the tariff text file")
+    parser.add_argument("--output", default="oman_tariff_data_final4", help="Output base filename (without extension)")
+    parser.add_argument("--mmap", action="store_true", help="Scan the file through mmap with bytes-level rules")
+    parser.add_argument("--strip-furniture", action="store_true", help="Drop repeated page headers/footers before parsing")
+    parser.add_argument("--parallel", action="store_true", help="Parse chapter chunks across a process pool")
+    parser.add_argument("--workers", type=int, help="Number of worker processes (default: all cores)")
+    parser.add_argument("--profile", action="store_true", help="Count and time each parse rule and print a report")
+    args = parser.parse_args()
+    if args.profile and (args.mmap or args.parallel):
+        parser.error("--profile instruments the text parse_line path; drop --mmap/--parallel")
+    if args.mmap and args.parallel:
+        parser.error("--parallel splits the decoded lines across workers; drop --mmap or --parallel")
+
+    furniture = None
+    if args.strip_furniture:
+        furniture = detect_page_furniture(iter_text_lines(args.input))
+        print(f"Stripping {len(furniture)} repeated page furniture lines")
+
+    if args.parallel:
+        tariff_data = parse_file_parallel(args.input, args.workers, furniture)
+        save_data(tariff_data, args.output)
+        return
+    tariff_parser = TariffParser(furniture=furniture, profile=args.profile)
+    save_data(tariff_parser.iter_entries(args.input, use_mmap=args.mmap), args.output)
+    if furniture:
+        print(f"Skipped {tariff_parser.skipped_lines} page furniture lines")
+    if tariff_parser.profile:
+        tariff_parser.profile.report()
+
+
+if __name__ == "__main__":
+    main()
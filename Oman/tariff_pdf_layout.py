@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Layout-aware table extraction from the text layer of tarfah.pdf.
+
+The plain text layer lists each table column on its own, which is why rates and
+indicators drift away from their HS codes (and why post-processing has to move
+duty rates back out of the SFTA/SG/URA fields). Here every text fragment keeps
+its glyph coordinates: fragments are grouped into rows by y, and each row is cut
+into columns at the x positions of the table header labels (H.S CODE,
+DESCRIPTION, DUTY RATE, EFTA, SG, USA). Pages without a text layer yield
+nothing, so callers can fall back to the vision model for scanned pages.
+"""
+
+import os
+import re
+import argparse
+import threading
+
+from tariff_parser import clean_text, is_arabic, save_data, ARABIC_RE, CHAPTER_RE, HEADING_RE, ENTRY_FIELDS
+
+# Header label -> column. Only the Latin part of each bilingual header is matched.
+COLUMN_LABELS = {
+    'HEADING': 'heading',
+    'H.S CODE': 'hs_code',
+    'DESCRIPTION': 'description',
+    'DUTY RATE': 'duty_rate',
+    'EFTA': 'efta',
+    'SG': 'sg',
+    'USA': 'usa',
+}
+# A page needs this many header labels to define a table layout
+MIN_LAYOUT_COLUMNS = 4
+# Fragments whose baselines are this close (in points) belong to the same row
+ROW_TOLERANCE = 3.0
+# How many earlier pages to search for a header when a page has none of its own
+LAYOUT_LOOKBACK = 10
+
+HS_CODE_CELL_RE = re.compile(r'^(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})\s+(\d{2})$')
+ARABIC_RUN_RE = re.compile(f'{ARABIC_RE.pattern}+')
+
+# Keys used by the vision extractor's page results (multimodal_tariff_processor.py).
+# Its prompt names the EFTA and USA indicator columns SFTA and URA.
+VISION_KEYS = {
+    'hs_code': 'H.S. Code',
+    'description_en': 'Description in English',
+    'description_ar': 'Description in Arabic',
+    'duty_rate': 'Duty Rate',
+    'efta': 'SFTA',
+    'sg': 'SG',
+    'usa': 'URA',
+}
+
+
+def page_fragments(page):
+    """
+    Return (x, y, text) for every text fragment on a PyPDF2 page, in page coordinates.
+
+    y grows upwards, as in PDF user space.
+    """
+    fragments = []
+
+    def visitor(text, cm, tm, font_dict, font_size):
+        text = clean_text(text)
+        if not text:
+            return
+        # Text matrix origin mapped through the current transformation matrix
+        x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+        y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+        fragments.append((x, y, text))
+
+    page.extract_text(visitor_text=visitor)
+    return fragments
+
+
+def group_rows(fragments, tolerance=ROW_TOLERANCE):
+    """Group fragments into rows, top of the page first, each row sorted left to right."""
+    rows = []
+    for x, y, text in sorted(fragments, key=lambda fragment: (-fragment[1], fragment[0])):
+        if rows and rows[-1][0] - y <= tolerance:
+            rows[-1][1].append((x, text))
+        else:
+            rows.append((y, [(x, text)]))
+    return [(y, sorted(cells)) for y, cells in rows]
+
+
+def _header_label(text):
+    latin = clean_text(ARABIC_RUN_RE.sub('', text)).upper()
+    return COLUMN_LABELS.get(latin)
+
+
+def find_layout(fragments):
+    """
+    Find the table header on a page.
+
+    Returns:
+        (header y, [(x, column), ...] sorted by x), or None when the page has no header
+    """
+    for y, cells in group_rows(fragments, tolerance=ROW_TOLERANCE * 4):
+        columns = {}
+        for x, text in cells:
+            column = _header_label(text)
+            if column and column not in columns:
+                columns[column] = x
+        if len(columns) >= MIN_LAYOUT_COLUMNS:
+            return y, sorted((x, column) for column, x in columns.items())
+    return None
+
+
+def assign_column(x, layout):
+    """Column whose header start is nearest to x (i.e. cut at the midpoints between headers)."""
+    return min(layout, key=lambda header: abs(header[0] - x))[1]
+
+
+def split_row(cells, layout):
+    """
+    Bucket a row's fragments into columns, joining fragments that share a column.
+
+    Arabic fragments always go to 'description_ar': the Arabic description column
+    has no Latin header label to anchor it.
+    """
+    columns = {}
+    for x, text in cells:
+        column = 'description_ar' if is_arabic(text) else assign_column(x, layout)
+        columns.setdefault(column, []).append(text)
+    return {column: ' '.join(texts) for column, texts in columns.items()}
+
+
+class LayoutExtractor:
+    """
+    Turn table rows into entries, carrying chapter, heading and layout across pages.
+
+    Entries use the text parser's record schema plus 'page'. A row with an HS code
+    starts an entry; rows without one continue its description, and fill rate or
+    indicator cells that the code row left empty (cells wrapped onto two lines).
+    """
+
+    def __init__(self):
+        self.layout = None
+        self.current_chapter = None
+        self.current_heading = None
+
+    def extract_page(self, fragments, page_number):
+        found = find_layout(fragments)
+        header_y = None
+        if found:
+            header_y, self.layout = found
+        if not self.layout:
+            return []
+
+        entries = []
+        entry = None
+        for y, cells in group_rows(fragments):
+            if header_y is not None and y >= header_y - ROW_TOLERANCE:
+                # Page title and column header rows
+                for _, text in cells:
+                    chapter_match = CHAPTER_RE.search(text)
+                    if chapter_match:
+                        self.current_chapter = chapter_match.group(1)
+                continue
+
+            row = split_row(cells, self.layout)
+            line = ' '.join(text for _, text in cells)
+            chapter_match = CHAPTER_RE.search(line)
+            if chapter_match and 'hs_code' not in row:
+                self.current_chapter = chapter_match.group(1)
+                continue
+
+            heading_match = HEADING_RE.fullmatch(row.get('heading', ''))
+            if heading_match:
+                self.current_heading = heading_match.group(1)
+
+            code_match = HS_CODE_CELL_RE.match(row.get('hs_code', ''))
+            if code_match:
+                entry = dict.fromkeys(ENTRY_FIELDS)
+                entry.update(chapter=self.current_chapter, heading=self.current_heading,
+                             hs_code=''.join(code_match.groups()),
+                             code_format='.'.join(code_match.groups()),
+                             description_en='', description_ar='', page=page_number)
+                entries.append(entry)
+            elif entry is None:
+                continue
+
+            self._fill_row(entry, row)
+        return entries
+
+    @staticmethod
+    def _fill_row(entry, row):
+        for column, field in (('description', 'description_en'), ('description_ar', 'description_ar')):
+            text = row.get(column)
+            if text:
+                entry[field] = f"{entry[field]} {text}" if entry[field] else text
+        for field in ('duty_rate', 'efta', 'sg', 'usa'):
+            if row.get(field) and not entry[field]:
+                entry[field] = row[field]
+
+
+def iter_layout_entries(pdf_path, first_page=1, last_page=None):
+    """Yield layout-extracted entries for a page range, in document order."""
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(pdf_path)
+    last_page = last_page or len(reader.pages)
+    extractor = LayoutExtractor()
+    # Pick up the chapter and layout from the pages before the range
+    for page_number in range(max(1, first_page - LAYOUT_LOOKBACK), first_page):
+        extractor.extract_page(page_fragments(reader.pages[page_number - 1]), page_number)
+
+    for page_number in range(first_page, last_page + 1):
+        yield from extractor.extract_page(page_fragments(reader.pages[page_number - 1]), page_number)
+
+
+class LayoutReader:
+    """
+    Layout-extracted entries of single pages, for callers that ask page by page.
+
+    One PdfReader stays open and the extractor's chapter, heading and layout are
+    carried forward, so a run over consecutive pages extracts each page once
+    instead of replaying LAYOUT_LOOKBACK pages per call. Every extracted page is
+    kept, so pages asked for slightly out of order (concurrent workers) are
+    served from the pages already passed; only a jump backwards or far ahead
+    replays the lookback. Safe to share between threads.
+    """
+
+    def __init__(self, pdf_path):
+        from PyPDF2 import PdfReader
+
+        self.reader = PdfReader(pdf_path)
+        self.extractor = None
+        self.next_page = None
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def page_entries(self, page_number):
+        with self.lock:
+            if page_number not in self.pages:
+                if self.next_page is None or not self.next_page <= page_number <= self.next_page + LAYOUT_LOOKBACK:
+                    # Pick up the chapter and layout from the pages before this one
+                    self.extractor = LayoutExtractor()
+                    self.next_page = max(1, page_number - LAYOUT_LOOKBACK)
+                while self.next_page <= page_number:
+                    entries = self.extractor.extract_page(page_fragments(self.reader.pages[self.next_page - 1]),
+                                                          self.next_page)
+                    self.pages.setdefault(self.next_page, entries)
+                    self.next_page += 1
+            return list(self.pages[page_number])
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def layout_reader(pdf_path):
+    """The shared LayoutReader of a PDF."""
+    path = os.path.abspath(pdf_path)
+    with _readers_lock:
+        if path not in _readers:
+            _readers[path] = LayoutReader(path)
+        return _readers[path]
+
+
+def extract_page_entries(pdf_path, page_number):
+    """Layout-extracted entries of a single page (empty for scanned or non-table pages)."""
+    return layout_reader(pdf_path).page_entries(page_number)
+
+
+def to_vision_entry(entry):
+    """Convert an entry to the keys used by the vision extractor's page results."""
+    code = entry['code_format'].replace('.', ' ') if entry['code_format'] else None
+    vision_entry = {key: entry[field] for field, key in VISION_KEYS.items()}
+    vision_entry['H.S. Code'] = code
+    return vision_entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract tariff table rows from the PDF using glyph positions")
+    parser.add_argument("--pdf", default="tarfah.pdf", help="Path to the tariff PDF")
+    parser.add_argument("--output", default="oman_tariff_data_layout", help="Output base filename (without extension)")
+    parser.add_argument("--first-page", type=int, default=1, help="First page to extract (1-based)")
+    parser.add_argument("--last-page", type=int, help="Last page to extract (default: last page of the PDF)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.pdf):
+        print(f"Error: PDF file not found at {args.pdf}")
+        return
+
+    save_data(iter_layout_entries(args.pdf, args.first_page, args.last_page), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Extract the text layer of tarfah.pdf and parse it without an intermediate tarfah.txt.
+
+Pages are extracted with PyPDF2 across a process pool (each worker opens the
+PDF once) and come back in page order, so their lines stream straight into
+TariffParser while later pages are still being extracted. Every entry is tagged
+with the page its HS code line is on. The extracted text can also be written
+out as tarfah.txt, with a form feed after each page, for the other text tools.
+"""
+
+import os
+import argparse
+import contextlib
+import concurrent.futures
+
+from tariff_parser import TariffParser, PAGE_BREAK, save_data
+
+DEFAULT_PDF = "tarfah.pdf"
+# Pages handed to a worker at a time; small enough that parsing starts right away
+PAGES_PER_TASK = 4
+
+# PdfReader opened once per worker process by _init_worker
+_reader = None
+
+
+def count_pages(pdf_path):
+    from PyPDF2 import PdfReader
+    return len(PdfReader(pdf_path).pages)
+
+
+def _init_worker(pdf_path):
+    global _reader
+    from PyPDF2 import PdfReader
+    _reader = PdfReader(pdf_path)
+
+
+def extract_page_text(page_number):
+    """Return the text layer of one page (1-based) from the worker's open PDF."""
+    return _reader.pages[page_number - 1].extract_text() or ''
+
+
+def iter_page_text(pdf_path, first_page=1, last_page=None, workers=None):
+    """
+    Yield (page number, text) for each page in order, extracting pages in parallel.
+
+    Results are yielded as soon as the next page in order is ready, so the
+    caller can parse early pages while later ones are still being extracted.
+    """
+    last_page = last_page or count_pages(pdf_path)
+    pages = range(first_page, last_page + 1)
+    workers = min(workers or os.cpu_count() or 1, len(pages)) or 1
+
+    if workers == 1:
+        _init_worker(pdf_path)
+        for page_number in pages:
+            yield page_number, extract_page_text(page_number)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                initargs=(pdf_path,)) as executor:
+        yield from zip(pages, executor.map(extract_page_text, pages, chunksize=PAGES_PER_TASK))
+
+
+def iter_page_lines(pages):
+    """Turn (page number, text) pairs into (page number, line) pairs."""
+    for page_number, text in pages:
+        for line in text.splitlines():
+            yield page_number, line
+
+
+def _write_pages(pages, out):
+    """Pass (page number, text) pairs through, writing each page and a form feed to out."""
+    for page_number, text in pages:
+        out.write(text)
+        out.write(f"\n{PAGE_BREAK}")
+        yield page_number, text
+
+
+def iter_pdf_entries(pdf_path, first_page=1, last_page=None, workers=None, text_file=None):
+    """
+    Parse the PDF text layer and yield entries in the usual record schema plus 'page'.
+
+    When text_file is given, the extracted text is written to it as it streams by.
+    """
+    tariff_parser = TariffParser()
+    finished = tariff_parser.entries
+
+    with contextlib.ExitStack() as stack:
+        pages = iter_page_text(pdf_path, first_page, last_page, workers)
+        if text_file:
+            pages = _write_pages(pages, stack.enter_context(open(text_file, 'w', encoding='utf-8')))
+
+        for page_number, line in iter_page_lines(pages):
+            tariff_parser.parse_line(line)
+            entry = tariff_parser.current_entry
+            if entry is not None and entry.page is None:
+                entry.page = page_number
+            if finished:
+                for record in finished:
+                    yield {**record.to_dict(), 'page': record.page}
+                finished.clear()
+
+    for record in tariff_parser.finish():
+        yield {**record.to_dict(), 'page': record.page}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse the Oman Customs Tariff straight from the PDF text layer")
+    parser.add_argument("--pdf", default=DEFAULT_PDF, help="Path to the tariff PDF")
+    parser.add_argument("--output", default="oman_tariff_data_pdf", help="Output base filename (without extension)")
+    parser.add_argument("--text-output", help="Also write the extracted text (e.g. tarfah.txt)")
+    parser.add_argument("--first-page", type=int, default=1, help="First page to extract (1-based)")
+    parser.add_argument("--last-page", type=int, help="Last page to extract (default: last page of the PDF)")
+    parser.add_argument("--workers", type=int, help="Number of extraction processes (default: all cores)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.pdf):
+        print(f"Error: PDF file not found at {args.pdf}")
+        return
+
+    entries = iter_pdf_entries(args.pdf, args.first_page, args.last_page, args.workers, args.text_output)
+    save_data(entries, args.output)
+    if args.text_output:
+        print(f"Text layer saved to {args.text_output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Concurrent page extraction behind one shared rate limiter.
+
+The vision scripts used to pace themselves with fixed sleeps between pages.
+Here up to `concurrency` pages are in flight at once, and every API request
+first reserves one request and its estimated tokens from two token buckets
+that refill at the provider's requests/min and tokens/min quota. The estimate
+covers all of max_tokens, so once the response reports its usage the unused
+part is settled back into the bucket. A full run is then bounded by the quota
+rather than by idle time.
+
+Blocking work (rendering, synchronous API clients) runs in worker threads via
+asyncio.to_thread, i.e. in the event loop's default executor. asyncio sizes
+that executor at min(32, cpu_count + 4) threads, which would silently cap the
+requests in flight well below --concurrency on small machines, so
+run_pipeline replaces it with one of pipeline_threads(concurrency) workers.
+
+    python vision_pipeline.py --concurrency 64 --pages 128   # check the peak in flight
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import threading
+import concurrent.futures
+
+DEFAULT_CONCURRENCY = 8
+# Worker threads beyond one per request in flight, for rendering and image optimization
+PIPELINE_THREAD_HEADROOM = 8
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 30000
+
+# Rough input cost of one page request: a full-page image plus the prompts.
+# Providers count max_tokens against the tokens/min quota up front as well.
+PAGE_IMAGE_TOKENS = 1100
+PROMPT_TOKENS = 400
+
+
+def estimate_request_tokens(max_tokens, images=1):
+    """Tokens a page request reserves against the tokens/min quota."""
+    return images * PAGE_IMAGE_TOKENS + PROMPT_TOKENS + max_tokens
+
+
+class TokenBucket:
+    """
+    Bucket refilled continuously at per_minute / 60 units per second.
+
+    Reservations are taken immediately, even past zero; the caller then waits
+    until the refill has paid the debt back. Waiters are served in the order
+    they reserved, and a request larger than the bucket still goes through.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """Take amount from the bucket and return the seconds to wait before using it."""
+        self._refill()
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def refund(self, amount):
+        """Give back (or, if negative, charge) the difference between reserved and used."""
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    Requests/min and tokens/min limits shared by every request of a run.
+
+    Use from a single event loop: reservations are plain arithmetic between awaits.
+    """
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.paused_until = 0.0
+        self.waited = 0.0
+
+    async def acquire(self, tokens=0):
+        """Wait until one request with this many tokens fits in both quotas."""
+        wait = self.requests.reserve(1)
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        wait = max(wait, self.paused_until - time.monotonic())
+        if wait > 0:
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+    def settle(self, reserved, used):
+        """Correct the token bucket once a response reports its actual usage."""
+        if self.tokens and used is not None:
+            self.tokens.refund(reserved - used)
+
+    def pause(self, seconds):
+        """Hold back every new request, e.g. after a 429 with a Retry-After."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def pipeline_threads(concurrency=DEFAULT_CONCURRENCY):
+    """Worker threads run_pipeline gives the event loop for concurrency items in flight."""
+    return concurrency + PIPELINE_THREAD_HEADROOM
+
+
+async def run_pipeline(items, process, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Run the coroutine function process(item) over items, at most concurrency at a time.
+
+    The loop's default executor (used by asyncio.to_thread) is replaced by one with
+    pipeline_threads(concurrency) workers for the run, and shut down afterwards,
+    so blocking calls are not capped at asyncio's default thread count.
+    Returns the results in the order of items.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=pipeline_threads(concurrency),
+                                                     thread_name_prefix="pipeline")
+    asyncio.get_running_loop().set_default_executor(executor)
+
+    async def run(item):
+        async with semaphore:
+            return await process(item)
+
+    try:
+        return await asyncio.gather(*(run(item) for item in items))
+    finally:
+        executor.shutdown(wait=False)
+
+
+def add_rate_limit_arguments(parser):
+    """Add the --concurrency/--rpm/--tpm options shared by the extraction scripts."""
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Pages in flight at once (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--rpm", type=int, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help=f"Requests per minute quota (default: {DEFAULT_REQUESTS_PER_MINUTE})")
+    parser.add_argument("--tpm", type=int, default=DEFAULT_TOKENS_PER_MINUTE,
+                        help=f"Tokens per minute quota, 0 for none (default: {DEFAULT_TOKENS_PER_MINUTE})")
+
+
+def peak_in_flight(items, concurrency, seconds=0.2):
+    """Run a blocking call of seconds per item through run_pipeline and return the most ever running at once."""
+    lock = threading.Lock()
+    running = peak = 0
+
+    def call():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(seconds)
+        with lock:
+            running -= 1
+
+    async def process(item):
+        await asyncio.to_thread(call)
+
+    asyncio.run(run_pipeline(range(items), process, concurrency))
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that run_pipeline keeps --concurrency blocking calls in flight")
+    parser.add_argument("--concurrency", type=int, default=64, help="Items in flight at once (default: 64)")
+    parser.add_argument("--pages", type=int, default=128, help="Items to run (default: 128)")
+    args = parser.parse_args()
+
+    peak = peak_in_flight(args.pages, args.concurrency)
+    expected = min(args.concurrency, args.pages)
+    print(f"Peak in flight: {peak} (expected {expected})")
+    if peak < expected:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()